@@ -1,33 +1,86 @@
 """ This file contains code for performing static code analysis on APK files. """
 
+# Mallodroid is only needed to analyze real apks, see checkMallodroid()
 try:
 	import mallodroid
 except:
-	print("error: could not find Mallodroid, make sure you have downloaded it and set your python path.")
-	exit(1)
+	mallodroid = None
 
-def analyze(apps, filename, app):
-	""" Performs a static code analysis on an app.
+import time
+
+from dex import mentionsSsl
+from fastcheck import checkAll
+from metrics import peakMemory
+from stats import *
+
+def checkMallodroid():
+	""" Exit with an error if Mallodroid cannot be found. """
+	if mallodroid is None:
+		print("error: could not find Mallodroid, make sure you have downloaded it and set your python path.")
+		exit(1)
+
+def analyzeApk(filename, timings = None, prefilter = True, mode = 'full'):
+	""" Performs a static code analysis on an APK file.
+		
+		This does not touch the dictionary of apps so it can be run
+		in a separate worker process.
+		
+		Unless the prefilter is turned off, apps whose dex files do not
+		mention any SSL classes or methods get zero counts without being
+		analyzed, see dex.py.
+		
+		The fast mode skips the python export, the cross references and the
+		call graph, and finds the same problems with fastcheck.py instead
+		of Mallodroid. The fake mode is for the apks of a fake store, see
+		analyzeFakeApk() in fakestore.py.
 		
 		Arguments:
-		apps     -- a dictionary with all apps and their meta data where the results will be stored
-		filename -- the filename of the app's apk
-		app      -- the ID of the app
+		filename  -- the filename of the app's apk
+		timings   -- dictionary where the time of each step is put, if given
+		prefilter -- whether to skip the analysis of apps without SSL code
+		mode      -- 'full' to analyze with Mallodroid, 'fast' to analyze with fastcheck.py or 'fake' for a fake store
+		
+		Returns:
+		A dictionary with the results of the analysis, or None if the analysis failed.
 		"""
+	if mode == 'fake':
+		from fakestore import analyzeFakeApk
+		return analyzeFakeApk(filename)
+	
+	if prefilter:
+		start = time.time()
+		candidate = mentionsSsl(filename)
+		if timings is not None:
+			timings['prefilter_seconds'] = time.time() - start
+		if not candidate:
+			return dict((field, 0) for field in ['trustmanagers', 'naive_trustmanagers', 'insecure_factories',
+				'custom_hostname_verifiers', 'naive_hostname_verifiers', 'allow_all_hostname_verifiers', 'ssl_error_handlers'])
+	
 	try:
+		start = time.time()
 		_a = mallodroid.apk.APK(filename)
 		_vm = mallodroid.dvm.DalvikVMFormat(_a.get_dex())
-		_vmx = mallodroid.uVMAnalysis(_vm)
-		_vm.create_python_export()
-		_gx = mallodroid.GVMAnalysis(_vmx, None)
-		
-		_vm.set_vmanalysis(_vmx)
-		_vm.set_gvmanalysis(_gx)
-		_vm.create_dref(_vmx)
-		_vm.create_xref(_vmx)
-		
-		_result = {'trustmanager' : [], 'hostnameverifier' : [], 'onreceivedsslerror' : []}
-		_result = mallodroid._check_all(_vm, _vmx, _gx)
+		parsed = time.time()
+		if mode == 'fast':
+			linked = parsed
+			_result = checkAll(_vm)
+		else:
+			_vmx = mallodroid.uVMAnalysis(_vm)
+			_vm.create_python_export()
+			_gx = mallodroid.GVMAnalysis(_vmx, None)
+			
+			_vm.set_vmanalysis(_vmx)
+			_vm.set_gvmanalysis(_gx)
+			_vm.create_dref(_vmx)
+			_vm.create_xref(_vmx)
+			linked = time.time()
+			
+			_result = {'trustmanager' : [], 'hostnameverifier' : [], 'onreceivedsslerror' : []}
+			_result = mallodroid._check_all(_vm, _vmx, _gx)
+		if timings is not None:
+			timings['parse_seconds'] = parsed - start
+			timings['xref_seconds'] = linked - parsed
+			timings['check_seconds'] = time.time() - linked
 		
 		trustmanagers = len(_result['trustmanager'])
 		naive_trustmanagers = 0
@@ -46,14 +99,66 @@ def analyze(apps, filename, app):
 				if hv['empty']:
 					naive_verifiers += 1
 		
-		apps[app]['unchecked'] = False
-		apps[app]['trustmanagers'] = trustmanagers
-		apps[app]['naive_trustmanagers'] = naive_trustmanagers
-		apps[app]['insecure_factories'] = factories
-		apps[app]['custom_hostname_verifiers'] = verifiers
-		apps[app]['naive_hostname_verifiers'] = naive_verifiers
-		apps[app]['allow_all_hostname_verifiers'] = allhostnames
-		apps[app]['ssl_error_handlers'] = errorhandlers
+		return {
+			'trustmanagers' : trustmanagers,
+			'naive_trustmanagers' : naive_trustmanagers,
+			'insecure_factories' : factories,
+			'custom_hostname_verifiers' : verifiers,
+			'naive_hostname_verifiers' : naive_verifiers,
+			'allow_all_hostname_verifiers' : allhostnames,
+			'ssl_error_handlers' : errorhandlers
+		}
 	
+	except MemoryError:
+		raise
 	except:
-		None
\ No newline at end of file
+		return None
+
+def analyzeApkTimed(filename, prefilter = True, mode = 'full'):
+	""" Performs a static code analysis on an APK file and measures it.
+		
+		Arguments:
+		filename  -- the filename of the app's apk
+		prefilter -- whether to skip the analysis of apps without SSL code
+		mode      -- 'full', 'fast' or 'fake', see analyzeApk()
+		
+		Returns:
+		A tuple with the result of analyzeApk() and a dictionary with the
+		time of each step and the peak memory the process has used so far.
+		"""
+	timings = {}
+	start = time.time()
+	result = analyzeApk(filename, timings, prefilter, mode)
+	timings['analysis_seconds'] = time.time() - start
+	timings['worker_peak_rss_kb'] = peakMemory()
+	return (result, timings)
+
+def storeResult(apps, app, result):
+	""" Store the result of an analysis in the meta data of an app.
+		
+		Arguments:
+		apps   -- a dictionary with all apps and their meta data
+		app    -- the ID of the app
+		result -- the result returned by analyzeApk(), or {'status':...} if the analysis hit a limit
+		"""
+	apps[app]['unchecked'] = False
+	apps[app]['analyzed'] = int(time.time())
+	for key in result:
+		apps[app][key] = result[key]
+	
+	# an app which hit a limit before has now been analyzed
+	if not 'status' in result and 'status' in apps[app]:
+		del apps[app]['status']
+	markChanged(app)
+
+def analyze(apps, filename, app):
+	""" Performs a static code analysis on an app.
+		
+		Arguments:
+		apps     -- a dictionary with all apps and their meta data where the results will be stored
+		filename -- the filename of the app's apk
+		app      -- the ID of the app
+		"""
+	result = analyzeApk(filename)
+	if result:
+		storeResult(apps, app, result)
@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+""" Benchmarks of the statistics, cache and report code on synthetic apps.
+
+Each corpus size is run in a separate process, so the peak memory of one
+size does not hide the next. Within a process the peak only grows, so each
+phase reports the peak of the process so far and how much the phase
+raised it. The results are written as JSON and can be compared with the
+results of an earlier run to find regressions.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, 'utilities')
+
+import cache
+
+from cache import *
+from metrics import peakMemory
+from output import *
+from record import *
+from stats import *
+
+from filesystem import *
+
+CATEGORIES = ['BOOKS_AND_REFERENCE', 'BUSINESS', 'COMICS', 'COMMUNICATION', 'EDUCATION',
+			  'ENTERTAINMENT', 'FINANCE', 'HEALTH_AND_FITNESS', 'LIBRARIES_AND_DEMO', 'LIFESTYLE',
+			  'APP_WALLPAPER', 'MEDIA_AND_VIDEO', 'MEDICAL', 'MUSIC_AND_AUDIO', 'NEWS_AND_MAGAZINES',
+			  'PERSONALIZATION', 'PHOTOGRAPHY', 'PRODUCTIVITY', 'SHOPPING', 'SOCIAL', 'SPORTS',
+			  'TOOLS', 'TRANSPORTATION', 'TRAVEL_AND_LOCAL', 'WEATHER', 'APP_WIDGETS', 'ARCADE',
+			  'BRAIN', 'CARDS', 'CASUAL', 'GAME_WALLPAPER', 'RACING', 'SPORTS_GAMES', 'GAME_WIDGETS']
+
+SUBCATEGORIES = ['apps_topselling_free', 'apps_topselling_paid', 'apps_topgrossing',
+				 'apps_movers_shakers', 'apps_topselling_new_free', 'apps_topselling_new_paid']
+
+PHASES = ['generate', 'cache_save', 'cache_load', 'statistics', 'report', 'report_incremental', 'restore_point']
+
+def generateApps(size, seed = 0):
+	""" Generate a dictionary of synthetic apps with the same meta data as crawled ones.
+		
+		Arguments:
+		size -- the number of apps
+		seed -- seed of the random generator, the same seed gives the same apps
+		
+		Returns:
+		A dictionary with apps and their AppRecords.
+		"""
+	r = random.Random(seed)
+	apps = {}
+	for i in xrange(size):
+		cat = r.choice(CATEGORIES)
+		meta = AppRecord(**{
+			'title':"Synthetic app %d" % i,
+			'creator':"Synthetic developer %d" % r.randint(0, size / 10),
+			'super_dev':int(r.random() < 0.05),
+			'price':u'Free' if r.random() < 0.8 else u'$0.99',
+			'downloads':str(10 ** r.randint(0, 9)),
+			'version':r.randint(1, 500),
+			'offer':1,
+			'rating':round(r.uniform(1, 5), 1) if r.random() < 0.9 else 0.0,
+			'date':time.gmtime(r.randint(1199145600, 1388534399)),
+			'categories':[(cat, subcat) for subcat in r.sample(SUBCATEGORIES, r.randint(1, 3))],
+			'internet':r.random() < 0.85,
+			'unchecked':True
+		})
+		if meta['internet'] and r.random() < 0.7:
+			meta['unchecked'] = False
+			for counter in COUNTERS:
+				meta[counter] = r.choice([0, 0, 0, 0, 1, 2])
+		apps["com.synthetic.app%d" % i] = meta
+	return apps
+
+def runSize(args):
+	""" Run all phases on a corpus of synthetic apps in this process.
+		
+		Arguments:
+		args -- the command line arguments object
+		
+		Returns:
+		A dictionary of phases and their time and peak memory.
+		"""
+	folder = tempfile.mkdtemp(prefix="hermes-benchmark-")
+	args.f_cache = os.path.join(folder, "cache.p")
+	args.db = os.path.join(folder, "cache.db") if args.use_db else None
+	args.result_cache = ""
+	args.stats_cache = os.path.join(folder, "stats.db")
+	args.f_journal = os.path.join(folder, "journal")
+	args.tex_dir = os.path.join(folder, "tex") + os.sep
+	args.skip_generating = False
+	args.skip_printing = True
+	
+	results = {}
+	def phase(name, function, *arguments):
+		best = None
+		value = None
+		before = peakMemory()
+		for n in xrange(args.repeat):
+			start = time.time()
+			value = function(*arguments)
+			elapsed = time.time() - start
+			best = elapsed if best is None else min(best, elapsed)
+		peak = peakMemory()
+		results[name] = {'seconds':round(best, 4), 'process_peak_rss_kb':peak, 'peak_rss_growth_kb':peak - before}
+		return value
+	
+	def coldReport(apps):
+		# without saved statistics everything is calculated, like the first run
+		if os.path.exists(args.stats_cache):
+			os.remove(args.stats_cache)
+		outputResults(args, apps)
+	
+	def incrementalReport(apps):
+		# what a run which analyzed a few apps reports, see updateStatistics()
+		for app in sorted(apps)[:args.changed]:
+			apps[app]['unchecked'] = False
+			markChanged(app)
+		outputResults(args, apps)
+	
+	def restorePoint(apps, journal):
+		# what the pipeline does between two restore points
+		for app in sorted(apps)[:args.restore_freq]:
+			apps[app]['unchecked'] = False
+			markChanged(app)
+			saveApp(args, apps, app)
+			appendJournal(journal, app, apps[app]['version'], None)
+		createRestorePoint(args, apps, journal)
+	
+	# the report prints progress, which is not part of the results
+	stdout = sys.stdout
+	sys.stdout = open(os.devnull, 'w')
+	try:
+		apps = phase('generate', generateApps, args.size, args.seed)
+		phase('cache_save', saveCache, args, apps)
+		if cache.database:
+			cache.database.close()
+			cache.database = None
+		apps = phase('cache_load', loadCache, args)
+		phase('statistics', calculateStatistics, apps)
+		phase('report', coldReport, apps)
+		phase('report_incremental', incrementalReport, apps)
+		journal = openJournal(args)
+		phase('restore_point', restorePoint, apps, journal)
+		journal.close()
+	finally:
+		sys.stdout = stdout
+		shutil.rmtree(folder, True)
+	return results
+
+def runBenchmarks(args):
+	""" Run the benchmarks of each corpus size in a separate process.
+		
+		Arguments:
+		args -- the command line arguments object
+		
+		Returns:
+		A dictionary with the results and information about the run.
+		"""
+	try:
+		commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=open(os.devnull, 'w')).strip()
+	except:
+		commit = None
+	
+	report = {
+		'commit':commit,
+		'time':time.strftime("%Y-%m-%dT%H:%M:%S"),
+		'python':platform.python_version(),
+		'numpy':numpy is not None,
+		'cache':'sqlite' if args.use_db else 'pickle',
+		'repeat':args.repeat,
+		'sizes':{}
+	}
+	for size in args.sizes:
+		print >> sys.stderr, "benchmarking {:,} apps".format(size)
+		command = [sys.executable, os.path.abspath(__file__), '--child', str(size),
+				   '--seed', str(args.seed), '--repeat', str(args.repeat), '--restore-freq', str(args.restore_freq),
+				   '--changed', str(args.changed)]
+		if args.use_db:
+			command.append('--db')
+		output = subprocess.check_output(command)
+		report['sizes'][str(size)] = json.loads(output.splitlines()[-1])
+	return report
+
+def compareResults(old, new, tolerance):
+	""" Print how the time of each phase changed between two runs.
+		
+		Arguments:
+		old       -- results of the earlier run
+		new       -- results of the later run
+		tolerance -- how much slower a phase may get, as a fraction, before it is a regression
+		
+		Returns:
+		The number of regressions.
+		"""
+	regressions = 0
+	if old.get('cache') != new.get('cache'):
+		print "warning: comparing a {} cache with a {} cache".format(old.get('cache'), new.get('cache'))
+	print "{:>10} {:>18} {:>10} {:>10} {:>8}".format("apps", "phase", "before", "after", "change")
+	for size in sorted(new['sizes'], key=int):
+		if not size in old['sizes']:
+			continue
+		for phase in PHASES:
+			if not phase in old['sizes'][size] or not phase in new['sizes'][size]:
+				continue
+			before = old['sizes'][size][phase]['seconds']
+			after = new['sizes'][size][phase]['seconds']
+			change = str(percentage(after - before, before))
+			flag = ""
+			if after > before * (1 + tolerance) and after - before > 0.01:
+				regressions += 1
+				flag = "  regression"
+			print "{:>10,} {:>18} {:>10.3f} {:>10.3f} {:>8}{}".format(int(size), phase, before, after, change, flag)
+	return regressions
+
+def parseArgs():
+	""" Parse command line arguments.
+	
+	Returns:
+	Command line argument object
+	"""
+	prog = os.path.basename(__file__)
+	epilog = "examples:\n\n"
+	epilog+= "  benchmark and save the results:\n"
+	epilog+= "  $ " + prog + " --output before.json\n\n"
+	epilog+= "  benchmark small corpora and compare with earlier results:\n"
+	epilog+= "  $ " + prog + " --sizes 10000,100000 --compare before.json\n\n"
+	
+	parser = argparse.ArgumentParser(
+		description='benchmark statistics, cache and report generation on synthetic apps.',
+		usage='%(prog)s [options]',
+		formatter_class=argparse.RawDescriptionHelpFormatter,
+		epilog=epilog)
+	
+	parser.add_argument('--sizes', help="comma separated list of corpus sizes.", dest="sizes", type=str, metavar=('NUM,...'), default="10000,100000,1000000")
+	parser.add_argument('--seed', help="seed of the synthetic apps.", dest="seed", type=int, metavar=('NUM'), default=0)
+	parser.add_argument('--repeat', help="how many times to run each phase, the fastest time is kept.", dest="repeat", type=int, metavar=('NUM'), default=1)
+	parser.add_argument('--restore-freq', help="number of apps saved before each restore point.", dest="restore_freq", type=int, metavar=('NUM'), default=10)
+	parser.add_argument('--changed', help="number of apps changed before the incremental report.", dest="changed", type=int, metavar=('NUM'), default=100)
+	parser.add_argument('--db', help="benchmark the SQLite cache instead of the pickle cache.", dest="use_db", action='store_true')
+	parser.add_argument('--output', help="file to write the results to (default: stdout).", dest="output", type=str, metavar=('FILE'))
+	parser.add_argument('--compare', help="results of an earlier run to compare with.", dest="compare", type=str, metavar=('FILE'))
+	parser.add_argument('--tolerance', help="how much slower a phase may get before it is a regression.", dest="tolerance", type=float, metavar=('FRACTION'), default=0.2)
+	parser.add_argument('--child', help=argparse.SUPPRESS, dest="size", type=int)
+	
+	args = parser.parse_args()
+	args.sizes = map(int, filter(None, args.sizes.split(',')))
+	return args
+
+def main():
+	args = parseArgs()
+	
+	if args.size:
+		print json.dumps(runSize(args), sort_keys=True)
+		return
+	
+	report = runBenchmarks(args)
+	if args.output:
+		json.dump(report, open(args.output, 'w'), indent=1, sort_keys=True)
+	elif not args.compare:
+		print json.dumps(report, indent=1, sort_keys=True)
+	
+	if args.compare:
+		if compareResults(json.load(open(args.compare)), report, args.tolerance) > 0:
+			exit(1)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,319 @@
+""" This file contains code for loading and saving the cache of apps.
+
+The cache is either a single pickle file (--cache) or an SQLite database
+(--db) with one row per app, which can be updated one app at a time.
+"""
+
+import json
+import os
+import pickle
+import sqlite3
+import threading
+
+import stats
+
+from metrics import timer
+from record import *
+
+# the open database connections, if any
+database = None
+resultCache = None
+resultsLock = threading.Lock()
+
+# size and modification time of the cache file when it was loaded
+loadedStamp = None
+
+SCHEMA = [
+	"""CREATE TABLE IF NOT EXISTS apps (
+		docid TEXT PRIMARY KEY,
+		category TEXT,
+		price TEXT,
+		internet INTEGER,
+		unchecked INTEGER,
+		version INTEGER,
+		meta BLOB,
+		title TEXT COLLATE NOCASE,
+		creator TEXT,
+		classification TEXT,
+		downloads INTEGER,
+		year INTEGER
+	)""",
+	"CREATE TABLE IF NOT EXISTS categories (docid TEXT, category TEXT, subcategory TEXT, PRIMARY KEY (docid, category, subcategory))",
+	"CREATE INDEX IF NOT EXISTS apps_category ON apps (category)",
+	"CREATE INDEX IF NOT EXISTS apps_price ON apps (price)",
+	"CREATE INDEX IF NOT EXISTS apps_internet ON apps (internet)",
+	"CREATE INDEX IF NOT EXISTS apps_unchecked ON apps (unchecked)",
+	"CREATE INDEX IF NOT EXISTS apps_version ON apps (version)",
+	"CREATE INDEX IF NOT EXISTS categories_category ON categories (category, subcategory)"
+]
+
+# columns added to tables after they were first created, rows are filled in from their meta data
+MIGRATIONS = [
+	('apps', 'title', "ALTER TABLE apps ADD COLUMN title TEXT COLLATE NOCASE"),
+	('apps', 'creator', "ALTER TABLE apps ADD COLUMN creator TEXT"),
+	('apps', 'classification', "ALTER TABLE apps ADD COLUMN classification TEXT"),
+	('apps', 'downloads', "ALTER TABLE apps ADD COLUMN downloads INTEGER"),
+	('apps', 'year', "ALTER TABLE apps ADD COLUMN year INTEGER")
+]
+
+# indexes of the columns used by queries, see query.py
+QUERY_INDEXES = [
+	"CREATE INDEX IF NOT EXISTS apps_title ON apps (title)",
+	"CREATE INDEX IF NOT EXISTS apps_creator ON apps (creator)",
+	"CREATE INDEX IF NOT EXISTS apps_classification ON apps (classification)",
+	"CREATE INDEX IF NOT EXISTS apps_downloads ON apps (downloads)",
+	"CREATE INDEX IF NOT EXISTS apps_year ON apps (year)"
+]
+
+def openDatabase(filename):
+	""" Open the SQLite database, creating tables if needed.
+
+		Arguments:
+		filename -- the database file
+
+		Returns:
+		A database connection.
+		"""
+	db = sqlite3.connect(filename)
+	for statement in SCHEMA:
+		db.execute(statement)
+
+	# databases made before the columns were added get them filled in once
+	added = False
+	for table,column,statement in MIGRATIONS:
+		if not column in [row[1] for row in db.execute("PRAGMA table_info(%s)" % table)]:
+			db.execute(statement)
+			added = True
+	if added:
+		rows = db.execute("SELECT docid, meta FROM apps").fetchall()
+		db.executemany("UPDATE apps SET title = ?, creator = ?, classification = ?, downloads = ?, year = ? WHERE docid = ?",
+			[queryColumns(toRecord(pickle.loads(str(meta)))) + (app,) for app,meta in rows])
+
+	for statement in QUERY_INDEXES:
+		db.execute(statement)
+	db.commit()
+	return db
+
+def getDatabase(args):
+	""" Get the connection to the database given on the command line. """
+	global database
+	if database is None:
+		database = openDatabase(args.db)
+	return database
+
+def queryColumns(meta):
+	""" Get the values of the columns used by queries: title, creator, classification, downloads and year. """
+	date = meta.get('date')
+	title = meta.get('title')
+	creator = meta.get('creator')
+	return (title.decode('utf-8', 'replace') if title else None,
+			creator.decode('utf-8', 'replace') if creator else None,
+			stats.classify(meta),
+			meta.get('downloads'),
+			date.tm_year if date else None)
+
+def upsertApp(db, app, meta):
+	""" Insert or update a single app in the database.
+
+		Arguments:
+		db   -- the database connection
+		app  -- the ID of the app
+		meta -- the meta data of the app
+		"""
+	categories = meta.get('categories', [])
+	db.execute("INSERT OR REPLACE INTO apps (docid, category, price, internet, unchecked, version, meta, title, creator, classification, downloads, year) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", (
+		app,
+		categories[0][0] if categories else None,
+		meta.get('price'),
+		meta.get('internet'),
+		meta.get('unchecked'),
+		meta.get('version'),
+		sqlite3.Binary(pickle.dumps(meta, pickle.HIGHEST_PROTOCOL))) + queryColumns(meta))
+	db.execute("DELETE FROM categories WHERE docid = ?", (app,))
+	db.executemany("INSERT OR IGNORE INTO categories (docid, category, subcategory) VALUES (?, ?, ?)",
+		[(app, cat, subcat) for cat,subcat in categories])
+
+def importPickle(db, filename):
+	""" Import a pickled cache into the database.
+
+		Arguments:
+		db       -- the database connection
+		filename -- the pickle file
+
+		Returns:
+		The number of apps imported.
+		"""
+	apps = pickle.load(open(filename, 'rb'))
+	for app,meta in apps.iteritems():
+		upsertApp(db, app, toRecord(meta))
+	db.commit()
+	return len(apps)
+
+def cacheStamp(args):
+	""" Get the size and modification time of the cache file, or None if there is none. """
+	try:
+		stat = os.stat(args.db or args.f_cache)
+		return (stat.st_size, stat.st_mtime)
+	except:
+		return None
+
+def loadCache(args):
+	""" Load the cache of apps.
+
+		If an SQLite database is used and it is empty, an existing pickle
+		cache is imported into it first.
+
+		Arguments:
+		args -- the command line arguments object
+
+		Returns:
+		A dictionary of apps and their AppRecords.
+		"""
+	global loadedStamp
+	loadedStamp = cacheStamp(args)
+	if not args.db:
+		apps = pickle.load(open(args.f_cache, 'rb'))
+
+		# caches from before AppRecord have dictionaries
+		for app,meta in apps.iteritems():
+			if not isinstance(meta, AppRecord):
+				apps[app] = toRecord(meta)
+		return apps
+
+	db = getDatabase(args)
+	if db.execute("SELECT COUNT(*) FROM apps").fetchone()[0] == 0 and os.path.isfile(args.f_cache):
+		print "importing cache from " + args.f_cache
+		print "imported {:,} apps".format(importPickle(db, args.f_cache))
+		loadedStamp = cacheStamp(args)
+
+	apps = {}
+	for app,meta in db.execute("SELECT docid, meta FROM apps"):
+		apps[app] = toRecord(pickle.loads(str(meta)))
+	return apps
+
+def saveApp(args, apps, app):
+	""" Save a single app to the cache.
+
+		This is a no-op for pickle caches, which can only be saved as a whole.
+		The change is written on the next call to commitCache().
+
+		Arguments:
+		args -- the command line arguments object
+		apps -- dictionary of apps and their meta data
+		app  -- the ID of the app to save
+		"""
+	if args.db:
+		upsertApp(getDatabase(args), app, apps[app])
+
+def commitCache(args, apps):
+	""" Make sure all changes to the cache are written to disk.
+
+		Arguments:
+		args -- the command line arguments object
+		apps -- dictionary of apps and their meta data
+		"""
+	with timer('cache_save'):
+		if args.db:
+			getDatabase(args).commit()
+		else:
+			pickle.dump(apps, open(args.f_cache, 'wb'), pickle.HIGHEST_PROTOCOL)
+
+def saveCache(args, apps):
+	""" Save all apps to the cache.
+
+		Arguments:
+		args -- the command line arguments object
+		apps -- dictionary of apps and their meta data
+		"""
+	if args.db:
+		db = getDatabase(args)
+		for app,meta in apps.iteritems():
+			upsertApp(db, app, meta)
+	commitCache(args, apps)
+
+def openResultCache(filename):
+	""" Open the cache of analysis results, creating tables if needed.
+
+		Results are stored by the SHA-256 of the apk, and each version of
+		an app points to the hash of its apk. The connection can be shared
+		between threads as long as resultsLock is held.
+
+		Arguments:
+		filename -- the database file
+
+		Returns:
+		A database connection.
+		"""
+	db = sqlite3.connect(filename, check_same_thread=False)
+	db.execute("CREATE TABLE IF NOT EXISTS results (sha256 TEXT PRIMARY KEY, result TEXT)")
+	db.execute("CREATE TABLE IF NOT EXISTS versions (docid TEXT, version INTEGER, sha256 TEXT, PRIMARY KEY (docid, version))")
+	db.commit()
+	return db
+
+def getResultCache(args):
+	""" Get the connection to the result cache given on the command line, or None if disabled. """
+	global resultCache
+	if resultCache is None and args.result_cache:
+		resultCache = openResultCache(args.result_cache)
+	return resultCache
+
+def lookupVersion(args, app, version):
+	""" Find the result of an earlier analysis of a version of an app.
+
+		Arguments:
+		args    -- the command line arguments object
+		app     -- the ID of the app
+		version -- the version code of the app
+
+		Returns:
+		The result of the analysis, or None if the version has not been analyzed.
+		"""
+	with resultsLock:
+		db = getResultCache(args)
+		if db is None:
+			return None
+		row = db.execute("SELECT results.result FROM versions JOIN results ON versions.sha256 = results.sha256 WHERE docid = ? AND version = ?", (app, version)).fetchone()
+	return json.loads(row[0]) if row else None
+
+def lookupHash(args, sha256):
+	""" Find the result of an earlier analysis of an identical apk.
+
+		Arguments:
+		args   -- the command line arguments object
+		sha256 -- the SHA-256 of the apk as a hex string
+
+		Returns:
+		The result of the analysis, or None if the apk has not been analyzed.
+		"""
+	with resultsLock:
+		db = getResultCache(args)
+		if db is None:
+			return None
+		row = db.execute("SELECT result FROM results WHERE sha256 = ?", (sha256,)).fetchone()
+	return json.loads(row[0]) if row else None
+
+def rememberResult(args, app, version, sha256, result):
+	""" Add the result of an analysis to the result cache.
+
+		The change is written on the next call to commitResultCache().
+
+		Arguments:
+		args    -- the command line arguments object
+		app     -- the ID of the app
+		version -- the version code of the app
+		sha256  -- the SHA-256 of the apk as a hex string
+		result  -- the result of the analysis
+		"""
+	with resultsLock:
+		db = getResultCache(args)
+		if db is None:
+			return
+		db.execute("INSERT OR REPLACE INTO results (sha256, result) VALUES (?, ?)", (sha256, json.dumps(result)))
+		db.execute("INSERT OR REPLACE INTO versions (docid, version, sha256) VALUES (?, ?, ?)", (app, version, sha256))
+
+def commitResultCache(args):
+	""" Make sure all changes to the result cache are written to disk. """
+	with resultsLock:
+		db = getResultCache(args)
+		if db is not None:
+			db.commit()
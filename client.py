@@ -0,0 +1,61 @@
+""" This file contains code for talking to the Google Play Store reliably.
+
+GooglePlayAPI makes every request with the module level functions of
+requests, so a new connection is opened for each call and a call which
+fails is lost. PooledRequests makes it use a pool of keep-alive sessions
+instead, and keeps the status codes PlayClient (see retry.py) needs to
+tell which calls are worth retrying.
+"""
+
+import socket
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# errors of the connection which are worth trying again
+TRANSIENT_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+					requests.exceptions.ChunkedEncodingError, socket.error)
+
+class PooledRequests(object):
+	""" Drop-in replacement for the requests module which reuses connections.
+
+		Each thread gets its own session, since sessions are not safe to
+		share between threads, and every request gets a timeout. The status
+		code of the last response of each thread is kept, since GooglePlayAPI
+		does not check it.
+		"""
+
+	def __init__(self, timeout = 60, pool_size = 10):
+		self.timeout = timeout
+		self.pool_size = pool_size
+		self.local = threading.local()
+
+	def session(self):
+		""" Get the session of the current thread. """
+		if not hasattr(self.local, 'session'):
+			session = requests.Session()
+			adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+			session.mount('http://', adapter)
+			session.mount('https://', adapter)
+			self.local.session = session
+		return self.local.session
+
+	def status(self):
+		""" Get the status code of the last response of the current thread, or None if there was none. """
+		return getattr(self.local, 'status', None)
+
+	def clearStatus(self):
+		self.local.status = None
+
+	def get(self, url, **kwargs):
+		kwargs.setdefault('timeout', self.timeout)
+		response = self.session().get(url, **kwargs)
+		self.local.status = response.status_code
+		return response
+
+	def post(self, url, data = None, **kwargs):
+		kwargs.setdefault('timeout', self.timeout)
+		response = self.session().post(url, data=data, **kwargs)
+		self.local.status = response.status_code
+		return response
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+""" Comparison of the fast analysis mode with the full analysis on local apks.
+
+Every apk is analyzed in both modes, each in a worker process of its own
+with the same limits as hermes.py uses. The report shows for each counter
+how many apps got the same value in both modes, the time each mode took,
+and which apps did not agree.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, 'utilities')
+
+from worker import *
+
+from numeric import *
+
+COUNTERS = ['trustmanagers', 'naive_trustmanagers', 'insecure_factories', 'custom_hostname_verifiers',
+			'naive_hostname_verifiers', 'allow_all_hostname_verifiers', 'ssl_error_handlers']
+
+MODES = ['full', 'fast']
+
+def findApks(paths):
+	""" Get the apks in a list of files and directories, sorted by filename. """
+	apks = []
+	for path in paths:
+		if os.path.isdir(path):
+			for root, dirs, files in os.walk(path):
+				apks += [os.path.join(root, f) for f in files if f.lower().endswith('.apk')]
+		else:
+			apks.append(path)
+	return sorted(apks)
+
+def compareModes(args, apks):
+	""" Analyze apks in both modes.
+
+		Arguments:
+		args -- the command line arguments object
+		apks -- list of filenames of the apks
+
+		Returns:
+		A list with a dictionary for each apk, holding the status, result
+		and seconds of each mode.
+		"""
+	workers = dict((mode, AnalysisWorker(args.timeout, args.memory * 1024 * 1024, args.recycle, False, mode)) for mode in MODES)
+	report = []
+	for n,apk in enumerate(apks):
+		entry = {'apk':apk}
+		for mode in MODES:
+			start = time.time()
+			status, result, timings = workers[mode].analyze(apk)
+			entry[mode] = {'status':status, 'result':result, 'seconds':time.time() - start}
+		report.append(entry)
+		sys.stdout.write("\ranalyzing apps... %6.2f%% %10s: %s\033[K " % (100.0 * (n + 1) / len(apks), "apk", os.path.basename(apk)))
+		sys.stdout.flush()
+	print ""
+	for worker in workers.values():
+		worker.stop()
+	return report
+
+def printReport(report):
+	""" Print how well the fast mode agrees with the full mode.
+
+		Apps which could not be analyzed in both modes are left out of the
+		agreement, but are counted.
+
+		Arguments:
+		report -- the result of compareModes()
+
+		Returns:
+		The number of apps which did not get the same counters in both modes.
+		"""
+	both = [e for e in report if e['full']['result'] and e['fast']['result']]
+	print "{:>30} {:>10} {:>10}".format("counter", "agree", "percent")
+	for counter in COUNTERS:
+		agree = len([e for e in both if e['full']['result'][counter] == e['fast']['result'][counter]])
+		print "{:>30} {:>10,} {:>10}".format(counter, agree, str(percentage(agree, len(both))))
+	differ = [e for e in both if any(e['full']['result'][c] != e['fast']['result'][c] for c in COUNTERS)]
+	print "{:>30} {:>10,} {:>10}".format("all counters", len(both) - len(differ), str(percentage(len(both) - len(differ), len(both))))
+	print ""
+
+	print "{:>30} {:>10} {:>10} {:>12}".format("mode", "analyzed", "failed", "seconds")
+	for mode in MODES:
+		failed = len([e for e in report if not e[mode]['result']])
+		seconds = sum(e[mode]['seconds'] for e in report)
+		print "{:>30} {:>10,} {:>10,} {:>12.2f}".format(mode, len(report) - failed, failed, seconds)
+	full = sum(e['full']['seconds'] for e in both)
+	fast = sum(e['fast']['seconds'] for e in both)
+	if fast > 0:
+		print "{:>30} {:>10.2f}x".format("speedup", full / fast)
+
+	if differ:
+		print ""
+		print "apps which do not agree (full/fast):"
+		for e in differ:
+			counts = ["{}={}/{}".format(c, e['full']['result'][c], e['fast']['result'][c])
+					  for c in COUNTERS if e['full']['result'][c] != e['fast']['result'][c]]
+			print "  {}: {}".format(e['apk'], ", ".join(counts))
+	return len(differ)
+
+def parseArgs():
+	""" Parse command line arguments.
+
+	Returns:
+	Command line argument object
+	"""
+	prog = os.path.basename(__file__)
+	epilog = "examples:\n\n"
+	epilog+= "  compare the modes on all apks in a folder:\n"
+	epilog+= "  $ " + prog + " apps/\n\n"
+	epilog+= "  compare the modes and save the result of each apk:\n"
+	epilog+= "  $ " + prog + " --output compare.json apps/\n\n"
+
+	parser = argparse.ArgumentParser(
+		description='compare the fast analysis mode with the full analysis on local apks.',
+		usage='%(prog)s [options] APK|FOLDER ...',
+		formatter_class=argparse.RawDescriptionHelpFormatter,
+		epilog=epilog)
+
+	parser.add_argument('paths', help="apks or folders with apks.", nargs='+', metavar=('APK|FOLDER'))
+	parser.add_argument('--timeout', help="seconds the analysis of an app may take before it is stopped, use 0 for no limit.", dest="timeout", type=int, metavar=('SECONDS'), default=900)
+	parser.add_argument('--memory', help="megabytes of memory the analysis of an app may use before it is stopped, use 0 for no limit.", dest="memory", type=int, metavar=('MB'), default=4096)
+	parser.add_argument('--recycle', help="number of apps a worker process analyzes before it is replaced, use 0 to never replace it.", dest="recycle", type=int, metavar=('NUM'), default=50)
+	parser.add_argument('--output', help="file to write the result of each apk to as JSON.", dest="output", type=str, metavar=('FILE'))
+
+	return parser.parse_args()
+
+def main():
+	args = parseArgs()
+	checkMallodroid()
+	apks = findApks(args.paths)
+	if not apks:
+		print "error: no apks found"
+		exit(1)
+
+	report = compareModes(args, apks)
+	if args.output:
+		json.dump(report, open(args.output, 'w'), indent=1, sort_keys=True)
+	if printReport(report) > 0:
+		exit(1)
+
+if __name__ == "__main__":
+	main()
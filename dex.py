@@ -0,0 +1,102 @@
+""" This file contains code for quickly looking into the dex files of an apk.
+
+Building the full model of an app with Androguard takes a long time, but
+an app can only contain the SSL code we look for if its dex files mention
+the classes and methods involved. Those names are found in the string
+table of each dex file, which can be scanned without parsing anything else.
+"""
+
+import array
+import mmap
+import re
+import struct
+import zipfile
+
+# names which the code we look for cannot do without, matched as parts of strings
+NEEDLES = ['TrustManager', 'HostnameVerifier', 'HOSTNAME_VERIFIER', 'SocketFactory', 'onReceivedSslError']
+
+DEX_FILE = re.compile(r'^classes\d*\.dex$')
+
+def stringData(buf, base = 0, length = None):
+	""" Find the part of a dex file which holds the strings.
+
+		The strings of a dex file are kept together in its data section,
+		so the part starts at the first string and ends after the last one.
+
+		Arguments:
+		buf    -- a string or an mmap containing the dex file
+		base   -- the offset of the dex file in buf
+		length -- the size of the dex file (default: the rest of buf)
+
+		Returns:
+		A tuple (start, end) with the offsets of the part in buf, or of the
+		whole dex file if it is not a valid one.
+		"""
+	if length is None:
+		length = len(buf) - base
+	whole = (base, base + length)
+	try:
+		if buf[base:base + 4] != "dex\n":
+			return whole
+		size, offset = struct.unpack('<II', buf[base + 0x38:base + 0x40])
+		if size == 0:
+			return (base, base)
+		ids = array.array('I')
+		ids.fromstring(buf[base + offset:base + offset + 4 * size])
+		if ids.itemsize != 4 or len(ids) != size or max(ids) >= length:
+			return whole
+		end = buf.find("\0", base + max(ids), base + length)
+		return (base + min(ids), base + length if end < 0 else end + 1)
+	except:
+		return whole
+
+def mentions(buf, base = 0, length = None, needles = NEEDLES):
+	""" Check if the strings of a dex file contain any of the needles, see stringData. """
+	start, end = stringData(buf, base, length)
+	return any(buf.find(needle, start, end) >= 0 for needle in needles)
+
+def storedOffset(file, info):
+	""" Get the offset of an uncompressed file in a zip file, or None if it is compressed. """
+	if info.compress_type != zipfile.ZIP_STORED:
+		return None
+	file.seek(info.header_offset)
+	header = file.read(30)
+	if header[0:4] != "PK\003\004":
+		return None
+	nameLength, extraLength = struct.unpack('<HH', header[26:30])
+	return info.header_offset + 30 + nameLength + extraLength
+
+def mentionsSsl(filename, needles = NEEDLES):
+	""" Check if any dex file of an apk mentions the classes and methods of SSL code.
+
+		Dex files which are stored uncompressed are memory mapped instead
+		of read.
+
+		Arguments:
+		filename -- the filename of the apk
+		needles  -- the names to look for
+
+		Returns:
+		False if no dex file mentions any of the needles, otherwise True
+		(also if the apk could not be read, so it gets a full analysis).
+		"""
+	try:
+		with open(filename, 'rb') as file:
+			apk = zipfile.ZipFile(file)
+			for info in apk.infolist():
+				if not DEX_FILE.match(info.filename):
+					continue
+				offset = storedOffset(file, info)
+				if offset is not None and info.file_size > 0:
+					data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+					try:
+						found = mentions(data, offset, info.file_size, needles)
+					finally:
+						data.close()
+				else:
+					found = mentions(apk.read(info.filename), needles=needles)
+				if found:
+					return True
+		return False
+	except:
+		return True
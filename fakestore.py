@@ -0,0 +1,324 @@
+""" This file contains a fake Google Play Store for benchmarking and testing.
+
+FakePlayAPI implements the part of GooglePlayAPI which Hermes uses
+(browse, list, details, bulkDetails and the purchase request behind
+downloads) on top of a synthetic catalog, and serves apks from a local
+HTTP server. Latency, error rate and apk size can be configured, and the
+catalog only depends on the seed, so runs can be compared with each other.
+
+The configuration is given as a comma separated list of key=value pairs,
+for example: apps=10000,latency=0.05,errors=0.01,size=5000000
+
+A second run with updates=0.1 finds a newer version of a tenth of the
+apps, for testing how changed apps are picked up.
+
+The served apks are not real apks, so they are analyzed by the stub in
+analyzeFakeApk() instead of Mallodroid.
+
+The fake store only uses the standard library, so it works without
+GooglePlayAPI and requests. Injected errors look like lost connections,
+so they are retried like those of the real store.
+"""
+
+import BaseHTTPServer
+import errno
+import random
+import socket
+import SocketServer
+import threading
+import time
+import urllib2
+import zlib
+
+from retry import PlayClient
+from stats import COUNTERS
+
+SUBCATEGORIES = ['apps_topselling_free', 'apps_topselling_paid', 'apps_topgrossing',
+				 'apps_movers_shakers', 'apps_topselling_new_free', 'apps_topselling_new_paid']
+
+PERMISSIONS = ['android.permission.INTERNET', 'android.permission.ACCESS_NETWORK_STATE',
+			   'android.permission.WAKE_LOCK', 'android.permission.VIBRATE']
+
+DEFAULTS = {
+	'apps':10000,        # number of apps in the store
+	'categories':20,     # number of categories
+	'subcategories':4,   # number of subcategories per category
+	'latency':0.0,       # seconds per API request
+	'errors':0.0,        # fraction of requests and downloads which fail
+	'size':1000000,      # average size of an apk in bytes
+	'updates':0.0,       # fraction of apps which have a newer version than in the catalog of the seed
+	'seed':0             # seed of the synthetic catalog
+}
+
+# errors of the connection to the apk server which are worth trying again
+TRANSIENT_ERRORS = (socket.error, urllib2.URLError)
+
+class LocalResponse(object):
+	""" The part of a response of requests which is used for downloading apks. """
+
+	def __init__(self, response):
+		self.response = response
+		self.status_code = response.getcode()
+		self.headers = response.info()
+
+	def iter_content(self, chunk_size = 1):
+		return iter(lambda: self.response.read(chunk_size), '')
+
+class LocalRequests(object):
+	""" Replacement for the requests module which downloads with urllib2.
+
+		The status code of the last response of each thread is kept, like
+		PooledRequests does.
+		"""
+
+	def __init__(self, timeout = 60):
+		self.timeout = timeout
+		self.local = threading.local()
+
+	def status(self):
+		return getattr(self.local, 'status', None)
+
+	def clearStatus(self):
+		self.local.status = None
+
+	def get(self, url, headers = None, cookies = None, verify = True, stream = False, timeout = None):
+		request = urllib2.Request(url, headers=dict(headers or {}))
+		if cookies:
+			request.add_header('Cookie', "; ".join("%s=%s" % pair for pair in cookies.items()))
+		try:
+			response = LocalResponse(urllib2.urlopen(request, timeout=timeout or self.timeout))
+		except urllib2.HTTPError as e:
+			response = LocalResponse(e)
+		self.local.status = response.status_code
+		return response
+
+class Message(object):
+	""" A bag of attributes, standing in for the protobuf messages of the API. """
+	def __init__(self, **kwargs):
+		self.__dict__.update(kwargs)
+
+def parseConfig(spec):
+	""" Parse the configuration of a fake store.
+
+		Arguments:
+		spec -- comma separated list of key=value pairs, missing keys get default values
+
+		Returns:
+		A dictionary with the configuration.
+		"""
+	config = dict(DEFAULTS)
+	for pair in filter(None, (spec or "").split(',')):
+		key, value = pair.split('=', 1)
+		if not key in DEFAULTS:
+			raise ValueError("unknown fake store setting: " + key)
+		config[key] = int(float(value)) if isinstance(DEFAULTS[key], int) else float(value)
+	return config
+
+class FakePlayAPI(object):
+	""" A synthetic Google Play Store. """
+
+	def __init__(self, config, timeout = 60):
+		self.config = config
+		self.http = LocalRequests(timeout)
+		self.categories = ["CATEGORY_%02d" % i for i in xrange(config['categories'])]
+		self.subcategories = SUBCATEGORIES[:max(1, min(len(SUBCATEGORIES), config['subcategories']))]
+		self.server = startServer(self)
+
+	def random(self, docid):
+		""" Get a random generator which is the same for every run. """
+		return random.Random(zlib.crc32("%s/%d" % (docid, self.config['seed'])))
+
+	def delay(self):
+		""" Wait for the configured latency and fail at the configured rate. """
+		if self.config['latency'] > 0:
+			time.sleep(self.config['latency'])
+		if random.random() < self.config['errors']:
+			raise socket.error(errno.ECONNRESET, "injected error")
+
+	def appIndex(self, docid):
+		return int(docid.rsplit('.', 1)[1])
+
+	def appSize(self, docid):
+		""" Get the size of an apk, between half and one and a half times the average. """
+		return int(self.config['size'] * (0.5 + self.random(docid).random()))
+
+	def appVersion(self, docid):
+		""" Get the version code and upload date of an app. """
+		# the same numbers as the details have always used, so catalogs stay the same
+		r = self.random(docid)
+		for i in xrange(1 + len(PERMISSIONS)):
+			r.random()
+		version = r.randint(1, 100)
+		date = r.randint(1230768000, 1388534399)
+		if random.Random(zlib.crc32("%s/%d/update" % (docid, self.config['seed']))).random() < self.config['updates']:
+			version += 1
+			date += 30 * 86400
+		return (version, time.strftime("%b %d, %Y", time.gmtime(date)))
+
+	def appsInList(self, cat, subcat):
+		""" Get the apps listed in a subcategory.
+
+			Apps belong to one category, and the lists of a category overlap
+			each other, so apps are found in several subcategories.
+			"""
+		c = self.categories.index(cat)
+		apps = range(c, self.config['apps'], len(self.categories))
+		start = len(apps) * self.subcategories.index(subcat) / (len(self.subcategories) + 1)
+		return ["com.fake.app.%d" % i for i in (apps[start:] + apps[:start])][:500]
+
+	def listEntry(self, docid):
+		""" Create the entry of an app as found in an app list. """
+		version, date = self.appVersion(docid)
+		r = self.random(docid)
+		return Message(
+			docid=unicode(docid),
+			title=u"Fake app %d" % self.appIndex(docid),
+			creator=u"Fake developer %d" % (self.appIndex(docid) % 997),
+			annotations=Message(badgeForCreator=[Message()] if r.random() < 0.05 else []),
+			offer=[Message(formattedAmount=u'Free' if r.random() < 0.8 else u'$0.99', offerType=1)],
+			details=Message(appDetails=Message(numDownloads=u"%s+" % "{:,}".format(10 ** r.randint(1, 9)),
+				versionCode=version, uploadDate=date)),
+			aggregateRating=Message(starRating=round(r.uniform(1, 5), 1)))
+
+	def detailsEntry(self, docid):
+		""" Create the details of an app. """
+		r = self.random(docid)
+		r.random()
+		permissions = [p for p in PERMISSIONS if r.random() < 0.7]
+		doc = self.listEntry(docid)
+		doc.details = Message(appDetails=Message(
+			numDownloads=doc.details.appDetails.numDownloads,
+			versionCode=doc.details.appDetails.versionCode,
+			uploadDate=doc.details.appDetails.uploadDate,
+			installationSize=self.appSize(docid),
+			permission=permissions))
+		return doc
+
+	def login(self, email = None, password = None, authSubToken = None):
+		self.delay()
+
+	def browse(self, cat = None, ctr = None):
+		self.delay()
+		return Message(category=[Message(dataUrl="browse?c=3&cat=" + c) for c in self.categories])
+
+	def list(self, cat, ctr = None, nb_results = None, offset = None):
+		self.delay()
+		if ctr is None:
+			return Message(doc=[Message(docid=unicode(s)) for s in self.subcategories])
+		apps = self.appsInList(cat, ctr)
+		start = int(offset or 0)
+		apps = apps[start:start + int(nb_results or 100)]
+		if not apps:
+			return Message(doc=[])
+		return Message(doc=[Message(child=[self.listEntry(docid) for docid in apps])])
+
+	def details(self, packageName):
+		self.delay()
+		return Message(docV2=self.detailsEntry(packageName))
+
+	def bulkDetails(self, packageNames):
+		self.delay()
+		return Message(entry=[Message(doc=self.detailsEntry(docid)) for docid in packageNames])
+
+	def executeRequestApi2(self, path, datapost = None, post_content_type = None):
+		""" Answer a purchase request with the location of the apk on the local server. """
+		self.delay()
+		if path != "purchase":
+			raise NotImplementedError("the fake store only supports purchase requests")
+		docid = dict(p.split('=', 1) for p in datapost.split('&'))['doc']
+		data = Message(
+			downloadUrl="http://127.0.0.1:%d/%s" % (self.server.server_address[1], docid),
+			downloadAuthCookie=[Message(name="MarketDA", value="fake")])
+		return Message(payload=Message(buyResponse=Message(purchaseStatusResponse=Message(appDeliveryData=data))))
+
+class ApkHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+	""" Serve synthetic apks, with support for resuming with Range requests. """
+
+	protocol_version = "HTTP/1.1"
+
+	def do_GET(self):
+		store = self.server.store
+		docid = self.path.lstrip('/')
+		size = store.appSize(docid)
+
+		start = 0
+		if 'Range' in self.headers:
+			start = int(self.headers['Range'].split('=')[1].split('-')[0])
+		if start >= size:
+			self.send_response(416)
+			self.send_header('Content-Length', '0')
+			self.end_headers()
+			return
+
+		if store.config['latency'] > 0:
+			time.sleep(store.config['latency'])
+		self.send_response(206 if start > 0 else 200)
+		self.send_header('Content-Type', 'application/vnd.android.package-archive')
+		self.send_header('Content-Length', str(size - start))
+		self.end_headers()
+
+		# the content only depends on the app, and a failing download stops halfway
+		block = (docid + "\n") * (65536 / (len(docid) + 1) + 1)
+		end = size
+		if random.random() < store.config['errors']:
+			end = start + (size - start) / 2
+		pos = start
+		while pos < end:
+			offset = pos % len(block)
+			chunk = block[offset:offset + min(end - pos, len(block) - offset)]
+			self.wfile.write(chunk)
+			pos += len(chunk)
+		if end < size:
+			self.close_connection = 1
+
+	def log_message(self, format, *args):
+		None
+
+class ApkServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+	daemon_threads = True
+
+def startServer(store):
+	""" Start serving apks of a fake store on a free local port. """
+	server = ApkServer(('127.0.0.1', 0), ApkHandler)
+	server.store = store
+	thread = threading.Thread(target=server.serve_forever)
+	thread.daemon = True
+	thread.start()
+	return server
+
+def fakeLogin(spec, retries = 5, timeout = 60):
+	""" Login to a fake Google Play Store with a synthetic catalog.
+
+		Arguments:
+		spec    -- the configuration of the fake store, see parseConfig()
+		retries -- how many times to retry a failed request
+		timeout -- how many seconds to wait for a download
+
+		Returns:
+		A PlayClient wrapping the fake store.
+		"""
+	api = FakePlayAPI(parseConfig(spec), timeout)
+	client = PlayClient(api, api.http, retries, TRANSIENT_ERRORS)
+	client.login()
+	return client
+
+def analyzeFakeApk(filename):
+	""" Analyze an apk served by a fake store.
+
+		The whole apk is read, so the time grows with the size like a real
+		analysis, and the counters only depend on the app.
+
+		Arguments:
+		filename -- the filename of the apk
+
+		Returns:
+		A dictionary with the results of the analysis, or None if it is not an apk of a fake store.
+		"""
+	with open(filename, 'rb') as apk:
+		docid = apk.readline().strip()
+		while apk.read(65536):
+			None
+	if not docid:
+		return None
+	r = random.Random(zlib.crc32(docid))
+	return dict((counter, r.choice([0, 0, 0, 0, 1, 2])) for counter in COUNTERS)
@@ -0,0 +1,143 @@
+""" This file contains a fast detector for the SSL problems Mallodroid looks for.
+
+Mallodroid needs the python export, the cross references and the call
+graph of an app, and it decompiles every class it reports. This detector
+only uses the parsed dex file: it walks the class hierarchy to find trust
+managers, hostname verifiers and web view clients, and reads the bytecode
+of their methods to see if they are empty. The result has the same form
+as the result of mallodroid._check_all(), so the same seven counters can
+be taken from it.
+"""
+
+import re
+
+TRUSTMANAGER_INTERFACES = ['Ljavax/net/ssl/TrustManager;', 'Ljavax/net/ssl/X509TrustManager;']
+VERIFIER_INTERFACES = ['Ljavax/net/ssl/HostnameVerifier;', 'Lorg/apache/http/conn/ssl/X509HostnameVerifier;']
+VERIFIER_CLASSES = ['Lorg/apache/http/conn/ssl/AbstractVerifier;', 'Lorg/apache/http/conn/ssl/AllowAllHostnameVerifier;',
+					'Lorg/apache/http/conn/ssl/BrowserCompatHostnameVerifier;', 'Lorg/apache/http/conn/ssl/StrictHostnameVerifier;']
+WEBVIEWCLIENT_CLASSES = ['Landroid/webkit/WebViewClient;']
+
+# name and descriptor (without spaces) of the methods which are checked
+CHECK_SERVER_TRUSTED = ('checkServerTrusted', '([Ljava/security/cert/X509Certificate;Ljava/lang/String;)V')
+VERIFY = ('verify', '(Ljava/lang/String;Ljavax/net/ssl/SSLSession;)Z')
+ON_RECEIVED_SSL_ERROR = ('onReceivedSslError', '(Landroid/webkit/WebView;Landroid/webkit/SslErrorHandler;Landroid/net/http/SslError;)V')
+
+GET_INSECURE = 'Landroid/net/SSLCertificateSocketFactory;->getInsecure(ILandroid/net/SSLSessionCache;)Ljavax/net/ssl/SSLSocketFactory;'
+ALLOW_ALL_CLASS = 'Lorg/apache/http/conn/ssl/AllowAllHostnameVerifier;'
+ALLOW_ALL_FIELD = 'Lorg/apache/http/conn/ssl/SSLSocketFactory;->ALLOW_ALL_HOSTNAME_VERIFIER'
+SSL_SOCKET_FACTORY = 'Lorg/apache/http/conn/ssl/SSLSocketFactory;'
+
+ACC_PUBLIC = 0x1
+
+TYPE = re.compile(r'L[^;\s()]+;')
+
+def typeNames(value):
+	""" Get a list of type names, from either a list or a string like '(La; Lb;)'. """
+	if not value:
+		return []
+	if isinstance(value, basestring):
+		return TYPE.findall(value)
+	return list(value)
+
+def ancestors(classes, name):
+	""" Get all superclasses and interfaces of a class.
+
+		Classes which are not in the app (like those of Android) end the
+		walk, but are included themselves.
+
+		Arguments:
+		classes -- dictionary of the classes of the app by name
+		name    -- the name of the class
+
+		Returns:
+		A set with the names of the superclasses and interfaces.
+		"""
+	found = set()
+	todo = [name]
+	while todo:
+		cls = classes.get(todo.pop())
+		if cls is None:
+			continue
+		for parent in [cls.get_superclassname()] + typeNames(cls.get_interfaces()):
+			if parent and not parent in found:
+				found.add(parent)
+				todo.append(parent)
+	return found
+
+def instructions(method):
+	""" Get the bytecode instructions of a method, or an empty list if it has no code. """
+	code = method.get_code()
+	if not code:
+		return []
+	return list(code.get_bc().get_instructions())
+
+def isEmpty(method):
+	""" Check if a method only returns, or only returns true. """
+	code = instructions(method)
+	if len(code) == 1:
+		return code[0].get_name() == 'return-void'
+	if len(code) == 2 and code[0].get_name().startswith('const') and code[1].get_name() == 'return':
+		operands = code[0].get_output().replace(' ', '').split(',')
+		return len(operands) == 2 and operands[1] == '1' and code[1].get_output().strip() == operands[0]
+	return False
+
+def hasSignature(method, signature):
+	""" Check if a method is public and has the name and descriptor of a signature. """
+	name, descriptor = signature
+	return (method.get_name() == name and method.get_access_flags() & ACC_PUBLIC and
+			method.get_descriptor().replace(' ', '') == descriptor)
+
+def usesInsecureFactory(code):
+	""" Check if bytecode gets an insecure SSL socket factory. """
+	for ins in code:
+		if ins.get_name() == 'invoke-static' and ins.get_output().replace(' ', '').endswith(GET_INSECURE):
+			return True
+	return False
+
+def usesAllowAllVerifier(code):
+	""" Check if bytecode creates or gets a hostname verifier which allows all hostnames. """
+	for ins in code:
+		name = ins.get_name()
+		if name == 'new-instance' and ins.get_output().endswith(ALLOW_ALL_CLASS):
+			return True
+		if name == 'sget-object' and ALLOW_ALL_FIELD in ins.get_output():
+			return True
+	return False
+
+def checkAll(vm):
+	""" Look for the SSL problems Mallodroid looks for in a parsed dex file.
+
+		Arguments:
+		vm -- the DalvikVMFormat of the app
+
+		Returns:
+		A dictionary with the same keys as the result of mallodroid._check_all(),
+		each a list of {'class', 'method', 'empty'} dictionaries.
+		"""
+	result = {'trustmanager':[], 'insecuresocketfactory':[], 'customhostnameverifier':[],
+			  'allowallhostnameverifier':[], 'onreceivedsslerror':[]}
+	classes = dict((cls.get_name(), cls) for cls in vm.get_classes())
+
+	for name,cls in classes.iteritems():
+		parents = None
+		for method in cls.get_methods():
+			found = {'class':name, 'method':method.get_name()}
+
+			# the hierarchy is only walked for classes with a method which might matter
+			for key,signature,interfaces in [
+					('trustmanager', CHECK_SERVER_TRUSTED, TRUSTMANAGER_INTERFACES),
+					('customhostnameverifier', VERIFY, VERIFIER_INTERFACES + VERIFIER_CLASSES),
+					('onreceivedsslerror', ON_RECEIVED_SSL_ERROR, WEBVIEWCLIENT_CLASSES)]:
+				if hasSignature(method, signature):
+					if parents is None:
+						parents = ancestors(classes, name)
+					if any(interface in parents for interface in interfaces):
+						result[key].append(dict(found, empty=isEmpty(method)))
+
+			code = instructions(method)
+			if usesInsecureFactory(code):
+				result['insecuresocketfactory'].append(found)
+			if name != SSL_SOCKET_FACTORY and usesAllowAllVerifier(code):
+				result['allowallhostnameverifier'].append(found)
+
+	return result
@@ -3,23 +3,35 @@
 
 import argparse
 import os
-import pickle
+import socket
 import sys
 
 sys.path.insert(0, 'utilities')
 
-from analyze import *
+from cache import *
+from metrics import *
 from output import *
+from scheduler import *
 from stats import *
-from store import *
 
 from filesystem import *
 from lists import *
-from numbers import *
+from numeric import *
 from strings import *
 
 #from google.protobuf import text_format
 
+# state files used with --fake-store unless given on the command line, so synthetic apps stay out of the real ones
+FAKE_STORE_FILES = {
+	'f_cache':".hermes-fake-cache.p",
+	'result_cache':".hermes-fake-results.db",
+	'stats_cache':".hermes-fake-stats.db",
+	'f_journal':".hermes-fake-journal",
+	'crawl_state':".hermes-fake-crawl.json",
+	'app_dir':'fake-apps/',
+	'tex_dir':'fake-tex/'
+}
+
 def searchTitle(apps, title):
 	""" Search for an app given its title. """
 	for app in apps:
@@ -45,10 +57,17 @@ def parseArgs():
 	epilog+= "  $ " + prog + " -u EMAIL -p PASS\n\n"
 	epilog+= "  use token:\n"
 	epilog+= "  $ " + prog + " -t TOKEN\n\n"
+	epilog+= "  benchmark against a fake store:\n"
+	epilog+= "  $ " + prog + " --fake-store apps=10000,latency=0.05 -P -G\n\n"
+	epilog+= "  coordinate workers on other hosts, and run a worker:\n"
+	epilog+= "  $ " + prog + " -t TOKEN --shard /shared/hermes.db --coordinate\n"
+	epilog+= "  $ " + prog + " -t TOKEN --shard /shared/hermes.db\n\n"
 	epilog+= "  generate statistic files:\n"
 	epilog+= "  $ " + prog + " -D -P\n\n"
 	epilog+= "  print statistics:\n"
 	epilog+= "  $ " + prog + " -D -G\n\n"
+	epilog+= "  look up apps in the cache, see '" + prog + " query -h':\n"
+	epilog+= "  $ " + prog + " query --class naive --category 'GAME_*'\n\n"
 	
 	parser = argparse.ArgumentParser(
 		description='download android apps and analyze the security of their communications.',
@@ -57,14 +76,34 @@ def parseArgs():
 		epilog=epilog)
 	
 	parser.add_argument('--cache', help="file for storing cache.", dest="f_cache", type=str, metavar=('FILE'), default=".hermes-cache.p")
-	parser.add_argument('--cache-pos', help="file for storing position used for resuming analyzer.", dest="f_pos", type=str, metavar=('FILE'), default=".hermes-cache-pos.p")
+	parser.add_argument('--db', help="SQLite database for storing cache, replaces --cache (which is imported on first use).", dest="db", type=str, metavar=('FILE'))
+	parser.add_argument('--result-cache', help="file for storing results of analyzed apks, use empty string to skip.", dest="result_cache", type=str, metavar=('FILE'), default=".hermes-results.db")
+	parser.add_argument('--stats-cache', help="file for storing statistics which are updated with changed apps only, use empty string to skip.", dest="stats_cache", type=str, metavar=('FILE'), default=".hermes-stats.db")
+	parser.add_argument('--journal', help="file for storing journal of processed apps used for resuming analyzer.", dest="f_journal", type=str, metavar=('FILE'), default=".hermes-journal")
 	
 	parser.add_argument('--category', help="category to fetch apps from (default: all)", dest="category", type=str, metavar=('NAME'))
 	parser.add_argument('--subcategory', help="subcategory to fetch apps from (default: all)", dest="subcategory", type=str, metavar=('NAME'))
 	parser.add_argument('--limit', help="the total number of apps to fetch from each category/subcategory.", dest="limit", type=int, metavar=('NUM'), default=500)
 	parser.add_argument('--offset', help="the offset from where to fetch apps in each category/subcategory.", dest="offset", type=int, metavar=('NUM'), default=0)
+	parser.add_argument('--details-batch', help="number of apps to look up per details request, use 1 for one request per app.", dest="details_batch", type=int, metavar=('NUM'), default=100)
+	parser.add_argument('--crawl-threads', help="number of subcategories to fetch app lists from in parallel.", dest="crawl_threads", type=int, metavar=('NUM'), default=1)
+	parser.add_argument('--delta', help="only look up known apps again if app lists show a new version, and skip subcategories fetched recently.", dest="delta", action='store_true')
+	parser.add_argument('--recrawl-after', help="hours before a subcategory is fetched again in --delta mode.", dest="recrawl_after", type=float, metavar=('HOURS'), default=20)
+	parser.add_argument('--crawl-state', help="file for storing when each subcategory was last fetched in --delta mode.", dest="crawl_state", type=str, metavar=('FILE'), default=".hermes-crawl.json")
+	
+	parser.add_argument('--retries', help="how many times to retry a failed request to the play store.", dest="retries", type=int, metavar=('NUM'), default=5)
+	parser.add_argument('--timeout', help="how many seconds to wait for a response from the play store.", dest="timeout", type=int, metavar=('SECONDS'), default=60)
 	
 	parser.add_argument('--restore-freq', help="how often to create restore point when analyzing apps, use 0 to skip.", dest="restore_freq", type=int, metavar=('NUM'), default=10)
+	parser.add_argument('--workers', help="number of processes used for analyzing apps in parallel.", dest="workers", type=int, metavar=('NUM'), default=1)
+	parser.add_argument('--analysis-timeout', help="seconds the analysis of an app may take before it is stopped, use 0 for no limit.", dest="analysis_timeout", type=int, metavar=('SECONDS'), default=900)
+	parser.add_argument('--analysis-memory', help="megabytes of memory the analysis of an app may use before it is stopped, use 0 for no limit.", dest="analysis_memory", type=int, metavar=('MB'), default=4096)
+	parser.add_argument('--recycle', help="number of apps a worker process analyzes before it is replaced, use 0 to never replace it.", dest="recycle", type=int, metavar=('NUM'), default=50)
+	parser.add_argument('--no-prefilter', help="analyze every app, instead of skipping apps whose dex files do not mention any SSL classes.", dest="prefilter", action='store_false')
+	parser.add_argument('--analysis-mode', help="how to analyze apps: with Mallodroid (full) or by only walking classes and bytecode (fast).", dest="analysis_mode", type=str, choices=['full', 'fast'], default='full')
+	parser.add_argument('--order', help="order to process apps in: most downloads first, smallest apk first, one category at a time or oldest analysis first (default: as found).", dest="order", type=str, choices=sorted(ORDERS))
+	parser.add_argument('--downloaders', help="number of apps to download in parallel.", dest="downloaders", type=int, metavar=('NUM'), default=1)
+	parser.add_argument('--queue-size', help="maximum number of downloaded apps waiting on disk for analysis.", dest="queue_size", type=int, metavar=('NUM'), default=10)
 	parser.add_argument('--app-dir', help="directory where apps will be stored during download and analytics.", dest="app_dir", type=str, metavar=('FOLDER'), default='apps/')
 	parser.add_argument('--tex-dir', help="directory where LaTeX reports will be saved.", dest="tex_dir", type=str, metavar=('FOLDER'), default='tex/')
 	
@@ -73,14 +112,32 @@ def parseArgs():
 	parser.add_argument('-p', help="password for logging into Google Play Store.", dest="passw", type=str, metavar=('PASS'))
 	parser.add_argument('-t', help="access token for accessing Google Play Store.", dest="token", type=str, metavar=('TOKEN'))
 	
+	parser.add_argument('--metrics', help="file for saving the time of each phase and of each app, as JSON or as CSV if it ends with .csv.", dest="metrics", type=str, metavar=('FILE'))
+	parser.add_argument('--live-summary', help="show apps per second and time left while processing apps.", dest="live_summary", action='store_true')
+	
+	parser.add_argument('--shard', help="SQLite database shared by a coordinator and workers on many hosts, see --coordinate.", dest="shard", type=str, metavar=('FILE'))
+	parser.add_argument('--coordinate', help="publish apps in the --shard database and merge the results of workers, instead of processing apps.", dest="coordinate", action='store_true')
+	parser.add_argument('--node', help="name of this worker in the --shard database (default: host and process ID).", dest="node", type=str, metavar=('NAME'), default="%s-%d" % (socket.gethostname(), os.getpid()))
+	parser.add_argument('--lease-size', help="number of apps a worker leases at a time.", dest="lease_size", type=int, metavar=('NUM'), default=20)
+	parser.add_argument('--lease-time', help="seconds before the apps leased by a worker are handed out again, renewed with each result.", dest="lease_time", type=int, metavar=('SECONDS'), default=3600)
+	
+	parser.add_argument('--fake-store', help="use a local fake play store with a synthetic catalog instead of logging in, with state files of its own and a stub analysis, see fakestore.py.", dest="fake_store", type=str, metavar=('SETTINGS'))
+	
 	parser.add_argument('-D', '--no-download', help="skip downloading and analysing apps.", dest="skip_download", action='store_true')
 	parser.add_argument('-G', '--no-generating', help="skip generating statistic files.", dest="skip_generating", action='store_true')
 	parser.add_argument('-P', '--no-printing', help="skip printing statistic output.", dest="skip_printing", action='store_true')
 	
 	args = parser.parse_args()
 	
+	# the fake store keeps its own state and serves apks only the stub analysis understands
+	if args.fake_store:
+		for dest,filename in FAKE_STORE_FILES.iteritems():
+			if getattr(args, dest) == parser.get_default(dest):
+				setattr(args, dest, filename)
+		args.analysis_mode = 'fake'
+	
 	# validate login credentials
-	if not args.skip_download:
+	if not args.skip_download and not args.fake_store:
 		if (not args.token) and not (args.user and args.passw):
 			print("error: you need to specify user/pass or token.")
 			exit(1)
@@ -88,6 +145,14 @@ def parseArgs():
 			print("error: you need to specify your android id. see -h for more info.")
 			exit(1)
 			
+	# validate sharding
+	if args.coordinate and not args.shard:
+		print("error: you need to specify the database to coordinate with --shard.")
+		exit(1)
+	if args.shard and args.skip_download:
+		print("error: --shard cannot be used with --no-download.")
+		exit(1)
+	
 	# validate modes
 	if args.skip_download and args.skip_printing and args.skip_generating:
 		print("what's the point if you skip everything?")
@@ -111,49 +176,40 @@ def processApps(args, gpapi, apps):
 	gpapi      -- the Google Play API object
 	apps       -- dictionary of apps and their meta data
 	"""
-	createAppFolder(args)
-	i = 0
-	j = 0
+	from analyze import storeResult
+	from pipeline import runPipeline
 	
-	for app in apps:
-		if shouldProcess(apps[app]):
-			j += 1		
-	print "found {:,} apps to process".format(j)
+	createAppFolder(args)
 	
-	pos = getRestorePoint(args)
+	# restore results of apps processed before the analyzer stopped, unless a new version was found since
+	processed = getRestorePoint(args)
+	for (app,version),result in processed.iteritems():
+		if result and app in apps and apps[app].get('version') == version:
+			storeResult(apps, app, result)
+			saveApp(args, apps, app)
 	
+	# we only care about apps which require INTERNET permission, we haven't checked yet, and are free
+	todo = []
 	for app,meta in apps.iteritems():
-			
-		# we only care about apps which require INTERNET permission, we haven't checked yet, and are free
-		if not shouldProcess(meta):
-			continue
-			
-		# skip until at the position where we should resume
-		i += 1
-		if i < pos:
-			continue
-			
-		# create restore point
-		if i % args.restore_freq == 0 and i > 0 and args.restore_freq > 0:
-			createRestorePoint(args, apps, i)
-		
-		# print progress
-		sys.stdout.write("\rprocessing apps... %6.2f%% %10s: %s\033[K " % (100.0 * i / j, "app", app))
-		sys.stdout.flush()
-		
-		try:
-			fname = args.app_dir + app + ".apk"
-			if download(gpapi, fname, app, meta['version'], meta['offer']):
-				analyze(apps, fname, app)
-				os.remove(fname)	
-		except:
-			None
+		if shouldProcess(meta) and not (app, meta.get('version')) in processed:
+			todo.append(app)
+	print "found {:,} apps to process".format(len(todo))
+	todo = schedule(args.order, apps, todo)
+	
+	# download, analyze and save in concurrent stages
+	journal = openJournal(args)
+	failed = runPipeline(args, gpapi, apps, todo, journal)
 	sys.stdout.write("\rdone processing apps\033[K\n")
 	sys.stdout.flush()
+	if failed > 0:
+		print "could not download {:,} apps, they will be tried again next time".format(failed)
+	stopped = len(filter(lambda app: 'status' in apps[app], todo))
+	if stopped > 0:
+		print "stopped analyzing {:,} apps which took too long, used too much memory or crashed".format(stopped)
 			
 	# clean up
 	print "saving to cache"
-	clearRestorePoint(args, apps)
+	clearRestorePoint(args, apps, journal)
 	deleteAppFolder(args)
 
 def main():
@@ -162,37 +218,91 @@ def main():
 	print "by ephracis"
 	print ""
 	
+	# workers of a coordinator get their apps from the shared database
+	worker = args.shard and not args.coordinate
+	
 	# load cache
 	apps = {}
 	try:
-		print "looking for cache"
-		apps = pickle.load(open(args.f_cache, 'rb'))
-		print "loaded {:,} apps from cache".format(len(apps))
+		if not worker:
+			print "looking for cache"
+			with timer('cache_load'):
+				apps = loadCache(args)
+			print "loaded {:,} apps from cache".format(len(apps))
 	except:
 		print "no cache found"
 	
-	# download + analyze
-	if not args.skip_download:	
-		print "logging in to play store"
-		api = login(args.id, args.user, args.passw, args.token)
+	# download + analyze, the store and analysis backends are only
+	# loaded here so reports can be made without them
+	if not args.skip_download:
+		from store import browse
+		
+		# the coordinator leaves the analysis to its workers
+		if not args.coordinate and args.analysis_mode != 'fake':
+			from analyze import checkMallodroid
+			checkMallodroid()
 		
-		print "constructing list of apps"
-		browse(args, api, apps)
+		print "logging in to play store"
+		with timer('login'):
+			if args.fake_store:
+				from fakestore import fakeLogin
+				api = fakeLogin(args.fake_store, args.retries, args.timeout)
+			else:
+				from store import login
+				api = login(args.id, args.user, args.passw, args.token, args.retries, args.timeout)
 		
-		print "starting app analyzer"
-		processApps(args, api, apps)
+		if worker:
+			from shard import runWorker
+			print "processing apps leased from " + args.shard
+			with timer('process'):
+				runWorker(args, api)
+		else:
+			if args.coordinate:
+				# workers wait for this run to finish, even before anything is published
+				from shard import startRun
+				startRun(args)
+			
+			print "constructing list of apps"
+			with timer('browse'):
+				browse(args, api, apps)
+			
+			if args.coordinate:
+				from shard import coordinate
+				print "starting coordinator"
+				with timer('process'):
+					coordinate(args, apps, schedule(args.order, apps, filter(lambda app: shouldProcess(apps[app]), apps)))
+			else:
+				print "starting app analyzer"
+				with timer('process'):
+					processApps(args, api, apps)
+		from retry import printClientStats
+		printClientStats(api)
 
-	if len(apps) == 0:
+	# the statistics are made by the coordinator, from the results of all workers
+	if worker:
+		args.skip_generating = args.skip_printing = True
+	elif len(apps) == 0:
 		print("error: no apps to analyze.")
 		exit(1)
 		
 	# statistics
 	if not (args.skip_generating and args.skip_printing):
 		print "generating output"
-		outputResults(args, apps)
+		with timer('report'):
+			outputResults(args, apps)
+	
+	# measurements
+	if args.metrics:
+		printMetrics()
+		saveMetrics(args.metrics)
 		
 	if args.skip_printing:
 		print "done"
 	
 if __name__ == "__main__":
-	main()
+	# hermes.py query [options] looks up apps in the cache, see query.py
+	if sys.argv[1:2] == ['query']:
+		import query
+		query.main(sys.argv[2:])
+	else:
+		main()
@@ -0,0 +1,156 @@
+""" This file contains code for measuring where the time of a run goes.
+
+The time spent in each phase (logging in, browsing, looking up details,
+downloading, parsing dex files, creating cross references, checking for
+SSL problems, saving the cache, ...) is added up, and every apk gets a
+record with its size, download time, analysis time and the peak memory
+the worker process which analyzed it has used so far. A worker analyzes
+several apks before it is replaced, so this is the most memory any of
+them needed, not the memory of the apk itself. At the end of a run it
+can all be saved as JSON, or the records of the apks as CSV.
+"""
+
+import csv
+import json
+import resource
+import threading
+import time
+
+from contextlib import contextmanager
+
+# upper bounds of the buckets of each histogram
+HISTOGRAMS = {
+	'size':[100000, 1000000, 5000000, 10000000, 20000000, 50000000, 100000000],
+	'download_seconds':[0.1, 0.5, 1, 2, 5, 10, 30, 60, 300],
+	'analysis_seconds':[0.1, 0.5, 1, 2, 5, 10, 30, 60, 300, 900],
+	'worker_peak_rss_kb':[65536, 131072, 262144, 524288, 1048576, 2097152, 4194304]
+}
+
+# columns of the per-apk records in the order they are exported
+COLUMNS = ['app', 'size', 'download_seconds', 'analysis_seconds', 'prefilter_seconds',
+		   'parse_seconds', 'xref_seconds', 'check_seconds', 'worker_peak_rss_kb', 'status']
+
+phases = {}
+apks = {}
+lock = threading.Lock()
+started = time.time()
+
+def addTime(phase, seconds):
+	""" Add time spent in a phase.
+
+		Arguments:
+		phase   -- the name of the phase
+		seconds -- the time spent
+		"""
+	with lock:
+		if not phase in phases:
+			phases[phase] = {'count':0, 'seconds':0.0}
+		phases[phase]['count'] += 1
+		phases[phase]['seconds'] += seconds
+
+@contextmanager
+def timer(phase):
+	""" Measure the time spent in a block of code, use it as: with timer('name'): ... """
+	start = time.time()
+	try:
+		yield
+	finally:
+		addTime(phase, time.time() - start)
+
+def recordApk(app, **fields):
+	""" Add fields to the record of an apk, see COLUMNS. """
+	with lock:
+		if not app in apks:
+			apks[app] = {'app':app}
+		apks[app].update(fields)
+
+def peakMemory():
+	""" Get the peak memory used by this process so far, in kilobytes. """
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def histogram(values, bounds):
+	""" Count how many values fall into each bucket.
+
+		Arguments:
+		values -- the values to count
+		bounds -- the upper bounds of the buckets, in increasing order
+
+		Returns:
+		A list of (upper bound, count), where the last bucket has no bound (None).
+		"""
+	counts = [0] * (len(bounds) + 1)
+	for value in values:
+		i = 0
+		while i < len(bounds) and value > bounds[i]:
+			i += 1
+		counts[i] += 1
+	return zip(bounds + [None], counts)
+
+def formatDuration(seconds):
+	""" Format a number of seconds as H:MM:SS. """
+	seconds = int(seconds)
+	return "%d:%02d:%02d" % (seconds / 3600, seconds / 60 % 60, seconds % 60)
+
+def liveSummary(done, total, start):
+	""" Get a short summary of the speed of processing apps.
+
+		Arguments:
+		done  -- the number of apps processed so far
+		total -- the number of apps to process
+		start -- the time processing started
+
+		Returns:
+		A string with the apps per second and the estimated time left.
+		"""
+	rate = done / max(time.time() - start, 0.001)
+	eta = formatDuration((total - done) / rate) if rate > 0 else "-:--:--"
+	return "%.2f apps/s, eta %s" % (rate, eta)
+
+def getMetrics():
+	""" Get all measurements of the run.
+
+		Returns:
+		A dictionary with the time of each phase, the records of the apks and histograms.
+		"""
+	with lock:
+		records = sorted(apks.values(), key=lambda x: x['app'])
+		report = {
+			'seconds':time.time() - started,
+			'peak_rss_kb':peakMemory(),
+			'phases':dict((phase, dict(value)) for phase,value in phases.iteritems()),
+			'apks':records,
+			'histograms':{}
+		}
+	for field,bounds in HISTOGRAMS.iteritems():
+		values = [record[field] for record in records if record.get(field) is not None]
+		report['histograms'][field] = histogram(values, bounds)
+	return report
+
+def saveMetrics(filename):
+	""" Save all measurements of the run.
+
+		Files ending with .csv get one row per apk, other files get
+		everything as JSON.
+
+		Arguments:
+		filename -- the file to save to
+		"""
+	report = getMetrics()
+	if filename.lower().endswith('.csv'):
+		with open(filename, 'wb') as file:
+			writer = csv.DictWriter(file, COLUMNS, extrasaction='ignore')
+			writer.writeheader()
+			for record in report['apks']:
+				writer.writerow(record)
+	else:
+		with open(filename, 'w') as file:
+			json.dump(report, file, indent=1, sort_keys=True)
+
+def printMetrics():
+	""" Print the time spent in each phase. """
+	report = getMetrics()
+	print "{:>14} {:>10} {:>12}".format("phase", "count", "seconds")
+	for phase in sorted(report['phases'], key=lambda x: -report['phases'][x]['seconds']):
+		p = report['phases'][phase]
+		print "{:>14} {:>10,} {:>12.2f}".format(phase, p['count'], p['seconds'])
+	print "{:>14} {:>10} {:>12.2f}".format("total", "", report['seconds'])
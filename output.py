@@ -1,15 +1,22 @@
 """ This file contains code for outputting results to both stdout and LaTeX files. """
 
+import cStringIO
+import json
+import os
 import sys
 import time
 
 from stats import *
 from filesystem import *
+from tables import *
 
 animation = ["-", "\\", "|", "/"]
 animation_pos = 0
 animation_last = time.time()
 
+# the LaTeX files generated by this run and the hashes of their content
+generated = {}
+
 def animate():
 	""" Print animation. Note: this will overwrite the previous two characters. """
 	global animation_last
@@ -21,6 +28,34 @@ def animate():
 		sys.stdout.write("\b\b%s " % (animation[animation_pos % len(animation)]))
 		sys.stdout.flush()
 
+def saveTexFile(filename, content):
+	""" Save a generated LaTeX file, leaving it untouched if its content is the same.
+		
+		Arguments:
+		filename -- filename of the latex file
+		content  -- the content of the file
+		"""
+	digest, changed = writeIfChanged(filename, content)
+	generated[os.path.basename(filename)] = {'sha256':digest, 'size':len(content), 'changed':changed}
+
+def saveManifest(args):
+	""" Save a manifest of the generated LaTeX files in the report folder.
+		
+		The manifest lists the hash and size of each file, so it only
+		changes when one of the files does.
+		
+		Arguments:
+		args -- command line argument object
+		
+		Returns:
+		The number of files which were written.
+		"""
+	manifest = {}
+	for name,entry in generated.iteritems():
+		manifest[name] = {'sha256':entry['sha256'], 'size':entry['size']}
+	writeIfChanged(args.tex_dir + "manifest.json", json.dumps(manifest, indent=1, sort_keys=True) + "\n")
+	return len(filter(lambda x: x['changed'], generated.values()))
+
 def printTableRow(row, widths):
 	""" Print out a row from a table of data.
 		
@@ -47,63 +82,49 @@ def printTexTableRow(row, file):
 	format += " \\\\ \\hline\n"
 	file.write(format % tuple(map(lambda x: fixRow(str(x)), row)))
 
-def printTexTable(table, filename, lastRowIsTotal = True):
+def printTexTable(table, filename):
 	""" Print out a table of data in LaTeX format to a file.
 		
 		Arguments:
-		table -- list of tuples with data points, the first row is header and the last row is total
-		file  -- file to print to
+		table    -- the Table to print
+		filename -- filename of the latex file to print to
 		"""
-	min = 2 if lastRowIsTotal else 1
-	if len(table) < min:
-		raise Exception("error: table need to be at least "+str(min)+" rows")
-	
-	file = open(filename, 'w')
-	cols = len(table[0])
+	file = cStringIO.StringIO()
+	cols = len(table.header)
 	
 	file.write("\\begin{{tabular}}{{|l|{}|}} \n".format("|".join(['r' for i in range(cols-1)])))
 	file.write("\\hline \n")
 	
-	printTexTableRow(map(lambda x: "\\textbf{%s}" % x, table[0]), file)
+	printTexTableRow(map(lambda x: "\\textbf{%s}" % x, table.header), file)
 	file.write("\\hline \n")
 	
-	body = table[1:]
-	if lastRowIsTotal:
-		body = body[:-1]
-	for row in body:
+	for row in table.rows:
 		printTexTableRow(row, file)
 	
-	if lastRowIsTotal:
+	if table.total:
 		file.write("\\hline \n")
-		printTexTableRow(map(lambda x: "\\textbf{%s}" % x, table[-1]), file)
+		printTexTableRow(map(lambda x: "\\textbf{%s}" % x, table.total), file)
 	
 	file.write("\\end{tabular}")
-	file.close()
+	saveTexFile(filename, file.getvalue())
 
-def printTable(table, lastRowIsTotal = True):
+def printTable(table):
 	""" Print out a table of data.
 		
 		Arguments:
-		table -- a list of tuples with data points, the first row is header and the last row is total
+		table -- the Table to print
 		"""
-	min = 2 if lastRowIsTotal else 1
-	if len(table) < min:
-		raise Exception("error: table need to be at least "+str(min)+" rows")
-	
 	# calculate column widths
 	margin = 3
-	widths = map(lambda col: max(map(lambda row: len(str(row[col])), table))+margin, range(len(table[0])))
+	widths = map(lambda col: max(map(lambda row: len(str(row[col])), table.lines()))+margin, range(len(table.header)))
 	
-	printTableRow(map(lambda x: x.upper(), table[0]), widths)
+	printTableRow(map(lambda x: x.upper(), table.header), widths)
 	print "-" * sum(widths)
-	body = table[1:]
-	if lastRowIsTotal:
-		body = body[:-1]
-	for row in body:
+	for row in table.rows:
 		printTableRow(row, widths)
-	if lastRowIsTotal:
+	if table.total:
 		print "-" * sum(widths)
-		printTableRow(table[-1], widths)
+		printTableRow(table.total, widths)
 
 def printTexGraph(data, filename):
 	""" Print a LaTeX file with a bar graph.
@@ -112,7 +133,7 @@ def printTexGraph(data, filename):
 		data     -- list of 3-tuples (name, absolute number, percentage)
 		filename -- filename of the latex file to print to
 		"""
-	file = open(filename, 'w')
+	file = cStringIO.StringIO()
 	
 	xmax = roundUp(max(map(lambda x: x[1], data)))
 	labels = ",".join(map(lambda x: "{{{}}}".format(x[0]), data))
@@ -154,7 +175,7 @@ def printTexGraph(data, filename):
 		file.write("\\end{axis}\n")
 	
 	file.write("\\end{tikzpicture}\n")
-	file.close()
+	saveTexFile(filename, file.getvalue())
 
 def printTexStackedGraph(legend, data, filename):
 	""" Print a LaTeX file with a stacked bar graph.
@@ -167,7 +188,7 @@ def printTexStackedGraph(legend, data, filename):
 		Note that the length of the legend list must match the number of
 		values in the data tuple.
 		"""
-	file = open(filename, 'w')
+	file = cStringIO.StringIO()
 	
 	stacks = len(legend)
 	xmax = roundUp(max(map(lambda x: sum(x[1:]), data)))
@@ -203,7 +224,7 @@ def printTexStackedGraph(legend, data, filename):
 		file.write("	};\n")
 	file.write("\\end{axis}\n")
 	file.write("\\end{tikzpicture}\n")
-	file.close()
+	saveTexFile(filename, file.getvalue())
 
 def outputResults(args, apps):
 	""" Print statistics out to LaTeX files.
@@ -217,70 +238,75 @@ def outputResults(args, apps):
 		createTexFolder(args)
 	
 	print "calculating statistics"
-	stats = calculateStatistics(apps)
+	if args.stats_cache:
+		stats = updateStatistics(args, apps)
+	else:
+		stats = calculateStatistics(apps)
 	_c = stats['categories']
 	_t = stats['total']
 	
-	top_size = 50
+	pairs = [
+		('trustmanagers','TrustManager','naive_trustmanagers','Naive TrustManager', 'trustmanagers'),
+		('custom_hostname_verifiers','HostnameVerifier','naive_hostname_verifiers','Naive HostnameVerifier', 'hostname_verifiers')
+	]
+	singles = [
+		('insecure_factories','Insecure SSLSocketFactory', 'ssl_socket_factories'),
+		('allow_all_hostname_verifiers','AllowAllHostnameVerifier', 'allow_all_hostname_verifiers'),
+		('ssl_error_handlers','onReceivedSslError', 'on_received_ssl_error_handlers'),
+		('native','Native', 'native'),
+		('custom','Custom', 'custom'),
+		('naive','Naive', 'naive'),
+		('bad','Bad', 'bad')
+	]
+	sections = ['native','custom','naive','bad']
 	
-	table = map(lambda x: (fixName(x), _c[x]['total'], _c[x]['internet'], percentage(_c[x]['internet'], _c[x]['total'])), _c)
-	table = sorted(table, key=lambda x: str2float(x[3]))
-	table.reverse()
-	table.insert(0, ('Category','Total','Internet permission','Internet permission'))
-	table.append(('Total', _t['total'], _t['internet'], percentage(_t['internet'], _t['total'])))
+	# build the tables of categories
+	checked = _t['internet'] - _t['unchecked']
+	internet = Table(('Category','Total','Internet permission','Internet permission'),
+		('Total', _t['total'], _t['internet'], percentage(_t['internet'], _t['total'])))
+	pairTables = map(lambda t: Table(('Category',t[1],t[3],t[1],t[3]),
+		("Total", _t[t[0]], _t[t[2]], percentage(_t[t[0]], checked), percentage(_t[t[2]], checked))), pairs)
+	singleTables = map(lambda t: Table(('Category',t[1],t[1]),
+		("Total", _t[t[0]], percentage(_t[t[0]], checked))), singles)
+	verifiers = []
+	for x in sorted(_c):
+		c = _c[x]
+		name = fixName(x)
+		checked = c['internet'] - c['unchecked']
+		internet.add(name, c['total'], c['internet'], percentage(c['internet'], c['total']))
+		for t,table in zip(pairs, pairTables):
+			table.add(name, c[t[0]], c[t[2]], percentage(c[t[0]], checked), percentage(c[t[2]], checked))
+		for t,table in zip(singles, singleTables):
+			table.add(name, c[t[0]], percentage(c[t[0]], checked))
+		total = sum(map(lambda y: c[y], sections))
+		verifiers.append(tuple([name] + map(lambda y: 0 if total == 0 else round(100.0 * c[y] / total, 3), sections)))
 	
+	internet.sort(3, True)
 	if not args.skip_generating:
-		printTexTable(table, args.tex_dir + "table_internet.tex")
-		data = map(lambda x: (x[0], x[2], int(str2float(x[3]))), table[1:-1])
-		printTexGraph(data, args.tex_dir + "graph_internet.tex")
+		printTexTable(internet, args.tex_dir + "table_internet.tex")
+		printTexGraph(internet.graph(2, 3), args.tex_dir + "graph_internet.tex")
 	
 	if not args.skip_printing:
 		print ""
-		printTable(table)
+		printTable(internet)
 		print ""
 	
-	l = [
-		('trustmanagers','TrustManager','naive_trustmanagers','Naive TrustManager', 'trustmanagers'),
-		('custom_hostname_verifiers','HostnameVerifier','naive_hostname_verifiers','Naive HostnameVerifier', 'hostname_verifiers')
-	]
-	for t in l:
-		table = map(lambda x: (fixName(x), _c[x][t[0]], _c[x][t[2]], percentage(_c[x][t[0]], _c[x]['internet'] - _c[x]['unchecked']), percentage(_c[x][t[2]], _c[x]['internet'] - _c[x]['unchecked'])), _c)
-		table = sorted(table, key=lambda x: str2float(x[4]))
-		table.reverse()
-		table.insert(0, ('Category',t[1],t[3],t[1],t[3]))
-		table.append(("Total", _t[t[0]], _t[t[2]], percentage(_t[t[0]], _t['internet'] - _t['unchecked']), percentage(_t[t[2]], _t['internet'] - _t['unchecked'])))
-		
+	for t,table in zip(pairs, pairTables):
+		table.sort(4, True)
 		if not args.skip_generating:
 			printTexTable(table, args.tex_dir + 'table_' + t[4] + '.tex')
-			data = map(lambda x: (x[0], x[1], int(str2float(x[3]))), table[1:-1])
-			printTexGraph(data, args.tex_dir + 'graph_' + t[4] + '.tex')
-			data = map(lambda x: (x[0], x[2], int(str2float(x[4]))), table[1:-1])
-			printTexGraph(data, args.tex_dir + 'graph_' + t[2] + '.tex')
+			printTexGraph(table.graph(1, 3), args.tex_dir + 'graph_' + t[4] + '.tex')
+			printTexGraph(table.graph(2, 4), args.tex_dir + 'graph_' + t[2] + '.tex')
 			 
 		if not args.skip_printing:
 			printTable(table)
 			print ""
-		 
-	l = [
-		 ('insecure_factories','Insecure SSLSocketFactory', 'ssl_socket_factories'),
-		 ('allow_all_hostname_verifiers','AllowAllHostnameVerifier', 'allow_all_hostname_verifiers'),
-		 ('ssl_error_handlers','onReceivedSslError', 'on_received_ssl_error_handlers'),
-		 ('native','Native', 'native'),
-		 ('custom','Custom', 'custom'),
-		 ('naive','Naive', 'naive'),
-		 ('bad','Bad', 'bad')
-	]
-	for t in l:
-		table = map(lambda x: (fixName(x), _c[x][t[0]], percentage(_c[x][t[0]], _c[x]['internet'] - _c[x]['unchecked'])), _c)
-		table = sorted(table, key=lambda x: str2float(x[2]))
-		table.reverse()
-		table.insert(0, ('Category',t[1],t[1]))
-		table.append(("Total", _t[t[0]], percentage(_t[t[0]], _t['internet'] - _t['unchecked'])))
-		
+	
+	for t,table in zip(singles, singleTables):
+		table.sort(2, True)
 		if not args.skip_generating:
 			printTexTable(table, args.tex_dir + 'table_' + t[2] + ".tex")
-			data = map(lambda x: (x[0], x[1], int(str2float(x[2]))), table[1:-1])
-			printTexGraph(data, args.tex_dir + 'graph_' + t[2] + '.tex')
+			printTexGraph(table.graph(1, 2), args.tex_dir + 'graph_' + t[2] + '.tex')
 		
 		if not args.skip_printing:
 			printTable(table)
@@ -288,56 +314,43 @@ def outputResults(args, apps):
 	
 	# sections
 	l = [
-		('years',('Year','Bad','Bad'),[]),
-		('downloads',('Downloads','Bad','Bad'),[]),
-		('ratings',('Rating','Bad','Bad'),[])
+		('years',Table(('Year','Bad','Bad')),sorted(stats['years'])),
+		('downloads',Table(('Downloads','Bad','Bad')),DOWNLOAD_RANGES),
+		('ratings',Table(('Rating','Bad','Bad')),RATING_RANGES)
 	]
-		 
-	# sort sections
-	c = stats['years']
-	_l = map(lambda x: (x, c[x]['bad'], percentage(c[x]['bad'], c[x]['internet'] - c[x]['unchecked'])), c)
-	_l = sorted(_l, key=lambda x: str2float(x[2]))
-	l[0][2].extend(_l)
-	
-	for x in ['0-100','100-10,000','10,000-1,000,000','1,000,000-100,000,000','100,000,000+']:
-		c = stats['downloads'][x]
-		l[1][2].append((x, c['bad'], percentage(c['bad'], c['internet']-c['unchecked'])))
-
-	for x in ['0-1','1-2','2-3','3-4','4-5','Unknown']:
-		c = stats['ratings'][x]
-		l[2][2].append((x, c['bad'], percentage(c['bad'], c['internet']-c['unchecked'])))
+	for _l in l:
+		for x in _l[2]:
+			c = stats[_l[0]][x]
+			_l[1].add(x, c['bad'], percentage(c['bad'], c['internet'] - c['unchecked']))
+	l[0][1].sort(2)
 	
 	# output sections
 	for _l in l:
-		c = stats[_l[0]]
-		table = _l[2]
-		table.insert(0, _l[1])
+		table = _l[1]
 		if not args.skip_generating:
-			printTexTable(table, args.tex_dir + 'table_'+_l[0]+'.tex', False)
-			data = map(lambda x: (x[0], x[1], int(str2float(x[2]))), table[1:])
-			printTexGraph(data, args.tex_dir + 'graph_' +_l[0]+'.tex')
+			printTexTable(table, args.tex_dir + 'table_'+_l[0]+'.tex')
+			printTexGraph(table.graph(1, 2), args.tex_dir + 'graph_' +_l[0]+'.tex')
 		if not args.skip_printing:
-			printTable(table, False)
+			printTable(table)
 			print ""
 
 	# verifier type
-	table = []
+	table = Table(("Verifier type", "Apps", "Percentage"))
 	tot = _t['internet'] - _t['unchecked']
 	for type in [('native', 'Native or none'), ('custom', 'Custom'), ('naive', 'Naive'),('bad', 'Bad')]:
-		table.append((type[1], _t[type[0]], percentage(_t[type[0]], tot)))
-	table.insert(0, ("Verifier type", "Apps", "Percentage"))
+		table.add(type[1], _t[type[0]], percentage(_t[type[0]], tot))
 	if not args.skip_generating:
-		printTexTable(table, args.tex_dir + 'table_verifier_type.tex', False)
+		printTexTable(table, args.tex_dir + 'table_verifier_type.tex')
 		legend = [('Native', 'green'),('Custom', 'yellow'),('Naive', 'orange'),('Bad', 'red')]
-		sections = ['native','custom','naive','bad']
 		data = map(lambda x: stats['total'][x], sections)
 		data = [tuple(['Verifier type'] + data)]
 		printTexStackedGraph(legend, data, args.tex_dir + 'graph_verifier_type.tex')
-		c = stats['categories']
-		data = map(lambda x: tuple([fixName(x)] + map(lambda y: c[x][y], sections)),c)
-		data = map(lambda x: tuple([x[0]] + map(lambda y: round(100.0 * y / sum(x[1:]), 3), x[1:])), data)
-		data = sorted(data, key=lambda x: -1 * (x[3] + x[4]))
+		data = sorted(verifiers, key=lambda x: -1 * (x[3] + x[4]))
 		printTexStackedGraph(legend, data, args.tex_dir + 'graph_verifier_type_categories.tex')
 	if not args.skip_printing:
-		printTable(table, False)
+		printTable(table)
 		print ""
+	
+	if not args.skip_generating:
+		written = saveManifest(args)
+		print "updated {:,} of {:,} LaTeX files".format(written, len(generated))
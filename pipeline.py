@@ -0,0 +1,196 @@
+""" This file contains code for downloading, analyzing and saving apps in concurrent stages. """
+
+import os
+import Queue
+import sys
+import threading
+import time
+
+from analyze import *
+from cache import *
+from metrics import *
+from store import *
+from worker import *
+from filesystem import *
+
+def downloader(args, gpapi, work, apks, results, slots):
+	""" Download apps until there is no more work.
+
+		Apps whose version or apk has been analyzed before are not
+		analyzed again, and not even downloaded if the version is known.
+		Every app ends up either in the queue for analysis or in the
+		queue of results, also when something goes wrong, since
+		runPipeline() waits for a result of each app.
+
+		Arguments:
+		args    -- the command line arguments object
+		gpapi   -- Google Play API object
+		work    -- queue of (app, version, offer) to download, None means stop
+		apks    -- queue where downloaded apps are put for analysis
+		results -- queue where apps which need no analysis are reported
+		slots   -- semaphore limiting the number of apps on disk
+		"""
+	while True:
+		task = work.get()
+		if task is None:
+			break
+		app, version, offer = task
+
+		fname = None
+		try:
+			result = lookupVersion(args, app, version)
+			if result:
+				recordApk(app, status='cached')
+				entry = (app, None, None, result)
+			else:
+				slots.acquire()
+				fname = args.app_dir + app + ".apk"
+				start = time.time()
+				try:
+					digest = download(gpapi, fname, app, version, offer)
+				except:
+					digest = None
+				addTime('download', time.time() - start)
+				recordApk(app, download_seconds=time.time() - start)
+				if not digest:
+					recordApk(app, status='download failed')
+					entry = (app, None, None, None)
+				else:
+					recordApk(app, size=os.path.getsize(fname))
+					result = lookupHash(args, digest)
+					if not result:
+						apks.put((app, fname, digest))
+						continue
+					recordApk(app, status='cached')
+					entry = (app, None, digest, result)
+		except:
+			# e.g. a locked result cache, the app is tried again next time
+			recordApk(app, status='download failed')
+			entry = (app, None, None, None)
+
+		# only apps waiting for analysis keep their slot
+		if fname:
+			try:
+				os.remove(fname)
+			except:
+				None
+			slots.release()
+		results.put(entry)
+
+def analyzer(args, apks, results):
+	""" Analyze downloaded apps until there is no more work.
+
+		Each analyzer has a worker process of its own, which analyzes the
+		apps within the time and memory limits given on the command line.
+
+		Arguments:
+		args    -- the command line arguments object
+		apks    -- queue of (app, filename, hash) to analyze, None means stop
+		results -- queue where the results are put
+		"""
+	worker = AnalysisWorker(args.analysis_timeout, args.analysis_memory * 1024 * 1024, args.recycle, args.prefilter, args.analysis_mode)
+	while True:
+		task = apks.get()
+		if task is None:
+			break
+		app, fname, digest = task
+		try:
+			status, result, timings = worker.analyze(fname)
+		except:
+			status, result, timings = 'analysis failed', None, {}
+		for phase in ['analysis', 'prefilter', 'parse', 'xref', 'check']:
+			if phase + '_seconds' in timings:
+				addTime(phase, timings[phase + '_seconds'])
+		recordApk(app, status=status, **timings)
+
+		# apps which hit a limit or crash the worker are not tried again
+		if status in ['timeout', 'oom', 'crashed']:
+			result = {'status':status}
+		results.put((app, fname, digest, result))
+	worker.stop()
+
+def startThread(target, args):
+	""" Start a daemon thread. """
+	thread = threading.Thread(target=target, args=args)
+	thread.daemon = True
+	thread.start()
+	return thread
+
+def runPipeline(args, gpapi, apps, todo, journal, report = None):
+	""" Download, analyze and save apps in concurrent stages.
+
+		Downloader threads fill a queue of apps stored in the app folder,
+		analyzer threads drain it, and the calling thread writes the results
+		back into the dictionary of apps and the journal. No more than
+		args.queue_size apps are kept on disk at once.
+
+		Arguments:
+		args    -- the command line arguments object
+		gpapi   -- Google Play API object
+		apps    -- dictionary of apps and their meta data
+		todo    -- list of apps to process
+		journal -- the journal file object where processed apps are recorded
+		report  -- function called as report(app, result) for each processed app, if given
+
+		Returns:
+		The number of apps which could not be downloaded.
+		"""
+	work = Queue.Queue()
+	apks = Queue.Queue()
+	results = Queue.Queue()
+	slots = threading.BoundedSemaphore(max(1, args.queue_size))
+
+	for app in todo:
+		work.put((app, apps[app]['version'], apps[app]['offer']))
+	for n in xrange(args.downloaders):
+		work.put(None)
+
+	downloaders = [startThread(downloader, (args, gpapi, work, apks, results, slots)) for n in xrange(args.downloaders)]
+	analyzers = [startThread(analyzer, (args, apks, results)) for n in xrange(max(1, args.workers))]
+
+	# write results as they come
+	failed = 0
+	start = time.time()
+	for n in xrange(len(todo)):
+		app, fname, digest, result = results.get()
+		if fname:
+			try:
+				os.remove(fname)
+			except:
+				None
+			slots.release()
+		if result:
+			storeResult(apps, app, result)
+			saveApp(args, apps, app)
+			# results of the fast mode are not reused, later runs may use the full mode
+			if digest and not 'status' in result and args.analysis_mode == 'full':
+				rememberResult(args, app, apps[app]['version'], digest, result)
+
+		# apps which could not be downloaded are tried again next time
+		if fname or result:
+			appendJournal(journal, app, apps[app]['version'], result)
+			if report:
+				report(app, result)
+		else:
+			failed += 1
+
+		# create restore point
+		if args.restore_freq > 0 and (n + 1) % args.restore_freq == 0:
+			with timer('restore_point'):
+				createRestorePoint(args, apps, journal)
+
+		# print progress
+		summary = ""
+		if args.live_summary:
+			summary = " (" + liveSummary(n + 1, len(todo), start) + ")"
+		sys.stdout.write("\rprocessing apps... %6.2f%%%s %10s: %s\033[K " % (100.0 * (n + 1) / len(todo), summary, "app", app))
+		sys.stdout.flush()
+
+	for thread in downloaders:
+		thread.join()
+	for thread in analyzers:
+		apks.put(None)
+	for thread in analyzers:
+		thread.join()
+
+	return failed
@@ -0,0 +1,188 @@
+""" This file contains code for looking up apps in the cache, run as: hermes.py query [options]
+
+With an SQLite cache (--db) the filters are answered by the indexes of
+the apps table, without loading the meta data of every app. A pickle
+cache has to be loaded as a whole and is searched app by app.
+"""
+
+import argparse
+import fnmatch
+import os
+import re
+import time
+
+from cache import *
+from output import *
+from stats import *
+
+from numeric import *
+from tables import *
+
+# lower and upper bounds of the downloads in each of DOWNLOAD_RANGES
+DOWNLOAD_BOUNDS = dict(zip(DOWNLOAD_RANGES, [(0, 100), (100, 10000), (10000, 1000000), (1000000, 100000000), (100000000, None)]))
+
+def escapeLike(text):
+	""" Escape the wildcards of a LIKE pattern, with backslash as escape character. """
+	return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def prefixRange(prefix):
+	""" Get the bounds of the strings which start with a prefix, so an index can be used to find them. """
+	return [prefix, prefix + u'\uffff']
+
+def buildQuery(args):
+	""" Turn the filters given on the command line into SQL.
+
+		Arguments:
+		args -- the command line arguments object
+
+		Returns:
+		A tuple (where, parameters) with the WHERE clause for the apps table
+		and its parameters.
+		"""
+	clauses = []
+	parameters = []
+	if args.title:
+		title = args.title.decode('utf-8')
+		clauses.append("title >= ? AND title < ? AND title LIKE ? ESCAPE '\\'")
+		parameters += prefixRange(title) + [escapeLike(title) + '%']
+	if args.title_contains:
+		clauses.append("title LIKE ? ESCAPE '\\'")
+		parameters.append('%' + escapeLike(args.title_contains.decode('utf-8')) + '%')
+	if args.creator:
+		clauses.append("creator = ?")
+		parameters.append(args.creator.decode('utf-8'))
+	if args.category:
+		prefix = re.split(r'[*?\[]', args.category)[0].decode('utf-8')
+		clauses.append("docid IN (SELECT docid FROM categories WHERE category >= ? AND category < ? AND category GLOB ?)")
+		parameters += prefixRange(prefix) + [args.category]
+	if args.classification:
+		clauses.append("classification = ?")
+		parameters.append(args.classification)
+	if args.downloads:
+		low, high = DOWNLOAD_BOUNDS[args.downloads]
+		clauses.append("downloads >= ?")
+		parameters.append(low)
+		if high is not None:
+			clauses.append("downloads < ?")
+			parameters.append(high)
+	if args.year:
+		clauses.append("year = ?")
+		parameters.append(args.year)
+	return (" AND ".join(clauses) or "1", parameters)
+
+def queryDatabase(args, db):
+	""" Find apps matching the filters in an SQLite cache.
+
+		Arguments:
+		args -- the command line arguments object
+		db   -- the database connection
+
+		Returns:
+		A tuple (count, rows) with the number of matching apps and the rows
+		(app, title, creator, downloads, year, class) of the most downloaded
+		of them.
+		"""
+	where, parameters = buildQuery(args)
+	count = db.execute("SELECT COUNT(*) FROM apps WHERE " + where, parameters).fetchone()[0]
+	rows = db.execute("SELECT docid, title, creator, downloads, year, classification FROM apps WHERE " + where +
+		" ORDER BY downloads DESC, docid LIMIT ?", parameters + [args.limit]).fetchall()
+	return (count, [(app, (title or u"").encode('utf-8'), (creator or u"").encode('utf-8'), downloads, year, classification)
+		for app,title,creator,downloads,year,classification in rows])
+
+def matches(args, meta):
+	""" Check if the meta data of an app matches the filters given on the command line, see buildQuery. """
+	title = (meta.get('title') or "").decode('utf-8', 'replace').lower()
+	if args.title and not title.startswith(args.title.decode('utf-8').lower()):
+		return False
+	if args.title_contains and not args.title_contains.decode('utf-8').lower() in title:
+		return False
+	if args.creator and meta.get('creator') != args.creator:
+		return False
+	if args.category and not any(fnmatch.fnmatchcase(cat, args.category) for cat,subcat in meta.get('categories', [])):
+		return False
+	if args.classification and classify(meta) != args.classification:
+		return False
+	if args.downloads:
+		low, high = DOWNLOAD_BOUNDS[args.downloads]
+		downloads = meta.get('downloads') or 0
+		if downloads < low or (high is not None and downloads >= high):
+			return False
+	if args.year and (not meta.get('date') or meta['date'].tm_year != args.year):
+		return False
+	return True
+
+def queryApps(args, apps):
+	""" Find apps matching the filters in a dictionary of apps, see queryDatabase. """
+	found = [app for app,meta in apps.iteritems() if matches(args, meta)]
+	found.sort(key=lambda app: (-(apps[app].get('downloads') or 0), app))
+	rows = []
+	for app in found[:args.limit]:
+		meta = apps[app]
+		rows.append((app, meta.get('title') or "", meta.get('creator') or "", meta.get('downloads'),
+			meta['date'].tm_year if meta.get('date') else None, classify(meta)))
+	return (len(found), rows)
+
+def parseArgs(argv):
+	""" Parse command line arguments.
+
+	Arguments:
+	argv -- the arguments after 'query'
+
+	Returns:
+	Command line argument object
+	"""
+	prog = "hermes.py query"
+	epilog = "examples:\n\n"
+	epilog+= "  naive apps by a creator in the game categories:\n"
+	epilog+= "  $ " + prog + " --db hermes.db --class naive --creator 'Some Games Inc.' --category 'GAME_*'\n\n"
+	epilog+= "  count the bad apps released in 2013 with at least a million downloads:\n"
+	epilog+= "  $ " + prog + " --db hermes.db --class bad --year 2013 --downloads 1,000,000-99,999,999 --count\n\n"
+
+	parser = argparse.ArgumentParser(
+		prog=prog,
+		description='look up apps in the cache.',
+		usage='%(prog)s [options]',
+		formatter_class=argparse.RawDescriptionHelpFormatter,
+		epilog=epilog)
+
+	parser.add_argument('--cache', help="file for storing cache.", dest="f_cache", type=str, metavar=('FILE'), default=".hermes-cache.p")
+	parser.add_argument('--db', help="SQLite database for storing cache, searched using its indexes.", dest="db", type=str, metavar=('FILE'))
+
+	parser.add_argument('--title', help="apps whose title starts with a text, ignoring case.", dest="title", type=str, metavar=('TEXT'))
+	parser.add_argument('--title-contains', help="apps whose title contains a text, ignoring case.", dest="title_contains", type=str, metavar=('TEXT'))
+	parser.add_argument('--creator', help="apps by a creator.", dest="creator", type=str, metavar=('NAME'))
+	parser.add_argument('--category', help="apps in a category, * and ? can be used as wildcards.", dest="category", type=str, metavar=('NAME'))
+	parser.add_argument('--class', help="apps of a class (see the statistics).", dest="classification", type=str, choices=CLASSES)
+	parser.add_argument('--downloads', help="apps in a range of downloads.", dest="downloads", type=str, choices=DOWNLOAD_RANGES)
+	parser.add_argument('--year', help="apps released in a year.", dest="year", type=int, metavar=('YEAR'))
+
+	parser.add_argument('--limit', help="the number of apps to show, the most downloaded first.", dest="limit", type=int, metavar=('NUM'), default=50)
+	parser.add_argument('--count', help="only show the number of apps found.", dest="count", action='store_true')
+
+	return parser.parse_args(argv)
+
+def main(argv):
+	args = parseArgs(argv)
+	start = time.time()
+
+	if args.db:
+		db = getDatabase(args)
+		if db.execute("SELECT COUNT(*) FROM apps").fetchone()[0] == 0 and os.path.isfile(args.f_cache):
+			print "importing cache from " + args.f_cache
+			print "imported {:,} apps".format(importPickle(db, args.f_cache))
+		count, rows = queryDatabase(args, db)
+	else:
+		try:
+			apps = loadCache(args)
+		except:
+			print "error: no cache found"
+			exit(1)
+		count, rows = queryApps(args, apps)
+
+	if not args.count and rows:
+		table = Table(('app', 'title', 'creator', 'downloads', 'year', 'class'))
+		for row in rows:
+			table.add(*[value if value is not None else '-' for value in row])
+		printTable(table)
+		print ""
+	print "found {:,} apps in {:.1f} ms".format(count, (time.time() - start) * 1000)
@@ -0,0 +1,151 @@
+""" This file contains the record which holds the meta data of an app.
+
+An AppRecord can be used like the dictionaries of meta data it replaces,
+with record['title'], 'trustmanagers' in record and record.get(), but it
+takes a fraction of the memory: the fields are slots instead of a
+dictionary, the release date is kept as a number of days since 1970,
+the downloads as an integer, and the categories as a tuple of shared
+(category, subcategory) pairs.
+"""
+
+import calendar
+import time
+
+# fields of a record, the results of the analysis are missing until the app has been analyzed,
+# status is only set if the analysis was stopped ('timeout', 'oom' or 'crashed'), size is the
+# size of the apk in bytes and analyzed is the time of the last analysis in seconds since 1970
+# new fields must be added at the end, since pickled records depend on the order
+RECORD_FIELDS = ['title', 'creator', 'super_dev', 'price', 'downloads', 'version', 'offer',
+				 'rating', 'days', 'categories', 'internet', 'unchecked',
+				 'trustmanagers', 'naive_trustmanagers', 'insecure_factories', 'custom_hostname_verifiers',
+				 'naive_hostname_verifiers', 'allow_all_hostname_verifiers', 'ssl_error_handlers',
+				 'status', 'size', 'analyzed']
+
+# keys which can be used to look up fields, 'date' is converted to and from 'days'
+KEYS = frozenset(RECORD_FIELDS + ['date'])
+
+# the (category, subcategory) pairs in use, so each pair is only kept once
+pairs = {}
+
+def categoryPair(cat, subcat):
+	""" Get the shared tuple of a category and subcategory. """
+	pair = (intern(str(cat)), intern(str(subcat)))
+	return pairs.setdefault(pair, pair)
+
+def toDays(date):
+	""" Convert a time.struct_time to days since 1970, or None if there is no date. """
+	if not date:
+		return None
+	return calendar.timegm(date) // 86400
+
+def fromDays(days):
+	""" Convert days since 1970 to a time.struct_time, or None if there is no date. """
+	if days is None:
+		return None
+	return time.gmtime(days * 86400)
+
+class AppRecord(object):
+	""" The meta data of an app. """
+
+	__slots__ = RECORD_FIELDS
+
+	def __init__(self, **meta):
+		"""
+			Arguments:
+			meta -- the fields of the record, unknown fields are left out
+			"""
+		for key,value in meta.iteritems():
+			if key in KEYS:
+				self[key] = value
+
+	def __getitem__(self, key):
+		try:
+			if key == 'date':
+				return fromDays(self.days)
+			if key in KEYS:
+				return getattr(self, key)
+		except AttributeError:
+			None
+		raise KeyError(key)
+
+	def __setitem__(self, key, value):
+		if key == 'date':
+			self.days = toDays(value)
+		elif key == 'downloads':
+			self.downloads = int(value or 0)
+		elif key == 'categories':
+			self.categories = tuple(categoryPair(cat, subcat) for cat,subcat in value)
+		elif key in KEYS:
+			setattr(self, key, value)
+		else:
+			raise KeyError(key)
+
+	def __delitem__(self, key):
+		if not key in self:
+			raise KeyError(key)
+		delattr(self, 'days' if key == 'date' else key)
+
+	def __contains__(self, key):
+		if key == 'date':
+			key = 'days'
+		return key in KEYS and hasattr(self, key)
+
+	def get(self, key, default = None):
+		try:
+			return self[key]
+		except KeyError:
+			return default
+
+	def keys(self):
+		""" Get the fields which are set, with the date as 'date'. """
+		return ['date' if field == 'days' else field for field in RECORD_FIELDS if hasattr(self, field)]
+
+	def asDict(self):
+		""" Get the fields which are set as a dictionary. """
+		return dict((key, self[key]) for key in self.keys())
+
+	def update(self, meta):
+		""" Set the fields which are set in another record or dictionary. """
+		for key in meta.keys():
+			self[key] = meta[key]
+
+	def addCategory(self, cat, subcat):
+		""" Add a category/subcategory the app is found in.
+
+			Returns:
+			True if the app was not known to be in the category/subcategory before.
+			"""
+		pair = categoryPair(cat, subcat)
+		categories = getattr(self, 'categories', ())
+		if pair in categories:
+			return False
+		self.categories = categories + (pair,)
+		return True
+
+	def __getstate__(self):
+		# which fields are set, and their values
+		present = 0
+		values = []
+		for i,field in enumerate(RECORD_FIELDS):
+			if hasattr(self, field):
+				present |= 1 << i
+				values.append(getattr(self, field))
+		return (present, tuple(values))
+
+	def __setstate__(self, state):
+		present, values = state
+		values = iter(values)
+		for i,field in enumerate(RECORD_FIELDS):
+			if present & (1 << i):
+				setattr(self, field, next(values))
+		if hasattr(self, 'categories'):
+			self.categories = tuple(categoryPair(cat, subcat) for cat,subcat in self.categories)
+
+	def __repr__(self):
+		return "AppRecord(%r)" % self.asDict()
+
+def toRecord(meta):
+	""" Get the meta data of an app as an AppRecord, converting a dictionary if needed. """
+	if isinstance(meta, AppRecord):
+		return meta
+	return AppRecord(**meta)
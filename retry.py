@@ -0,0 +1,96 @@
+""" This file contains code for retrying calls to the Google Play Store.
+
+PlayClient wraps a Google Play API object, or the fake store, and retries
+calls which fail with an error which may go away by itself: a lost
+connection, a timeout or a response saying the server is busy or failing.
+Other errors, like bad credentials or apps which were removed, are raised
+at once. Only the standard library is used, so the fake store can be used
+without requests.
+"""
+
+import random
+import threading
+import time
+
+# HTTP status codes of responses which are worth trying again
+TRANSIENT_STATUS = [429, 500, 502, 503, 504]
+
+class PlayClient(object):
+	""" Wrapper around a Google Play API object which retries failed calls.
+
+		Any method of the API can be called on the client. A call which
+		fails with a transient error is retried after a random delay which
+		grows exponentially with each attempt, up to a limit. The number of
+		calls, retries and failures are counted per method.
+		"""
+
+	def __init__(self, api, http, retries = 5, transient = (), backoff = 0.5, max_backoff = 30.0):
+		"""
+			Arguments:
+			api         -- the Google Play API object to wrap
+			http        -- the replacement for the requests module used by the API,
+			               which keeps the status code of the last response of each thread
+			retries     -- how many times to retry a failed call
+			transient   -- the types of errors which are worth trying again
+			backoff     -- the delay before the first retry, in seconds
+			max_backoff -- the longest delay between two attempts, in seconds
+			"""
+		self.api = api
+		self.http = http
+		self.transient = transient
+		self.retries = retries
+		self.backoff = backoff
+		self.max_backoff = max_backoff
+		self.stats = {}
+		self.lock = threading.Lock()
+
+	def count(self, method, field):
+		""" Increase one of the counters of a method. """
+		with self.lock:
+			if not method in self.stats:
+				self.stats[method] = {'calls':0, 'retries':0, 'failures':0}
+			self.stats[method][field] += 1
+
+	def isTransient(self, error):
+		""" Check if an error of the current thread may go away if the call is retried. """
+		return isinstance(error, self.transient) or self.http.status() in TRANSIENT_STATUS
+
+	def call(self, method, function, *args, **kwargs):
+		""" Call a function of the API, retrying if it fails with a transient error.
+
+			Arguments:
+			method   -- the name of the method (used for counting)
+			function -- the function to call
+
+			Returns:
+			The value returned by the function.
+			"""
+		self.count(method, 'calls')
+		attempt = 0
+		while True:
+			self.http.clearStatus()
+			try:
+				return function(*args, **kwargs)
+			except Exception as e:
+				if attempt >= self.retries or not self.isTransient(e):
+					self.count(method, 'failures')
+					raise
+			self.count(method, 'retries')
+			time.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt)))
+			attempt += 1
+
+	def __getattr__(self, name):
+		attr = getattr(self.api, name)
+		if not callable(attr):
+			return attr
+		def call(*args, **kwargs):
+			return self.call(name, attr, *args, **kwargs)
+		return call
+
+def printClientStats(client):
+	""" Print the number of calls, retries and failures of a PlayClient. """
+	if not isinstance(client, PlayClient):
+		return
+	for method in sorted(client.stats):
+		s = client.stats[method]
+		print "{:>20}: {:,} calls, {:,} retries, {:,} failures".format(method, s['calls'], s['retries'], s['failures'])
@@ -0,0 +1,61 @@
+""" This file contains the orders in which apps can be processed.
+
+When a run is stopped early, the order decides which apps were covered:
+the most popular apps, the most apps per hour by taking small apks first,
+an even spread over the categories, or the apps whose results are the
+oldest. Each order is a function taking the apps and the list of apps to
+process and returning the list in the order to process them. New orders
+are added to ORDERS.
+"""
+
+def byDownloads(apps, todo):
+	""" Most downloaded apps first. """
+	return sorted(todo, key=lambda app: (-(apps[app].get('downloads') or 0), app))
+
+def bySize(apps, todo):
+	""" Smallest apks first, apps of unknown size last. """
+	return sorted(todo, key=lambda app: (apps[app].get('size') is None, apps[app].get('size'), app))
+
+def byStaleness(apps, todo):
+	""" Apps which were never analyzed first, then those analyzed the longest time ago. """
+	return sorted(todo, key=lambda app: (apps[app].get('analyzed') or 0, app))
+
+def byCategory(apps, todo):
+	""" One app from each category in turn, the most downloaded apps of each category first.
+
+		Apps are counted in their first category, apps without one are put
+		last.
+		"""
+	categories = {}
+	for app in byDownloads(apps, todo):
+		pairs = apps[app].get('categories')
+		categories.setdefault(pairs[0][0] if pairs else None, []).append(app)
+
+	queues = [categories[cat] for cat in sorted(categories, key=lambda cat: (cat is None, cat))]
+	order = []
+	for i in xrange(max(len(queue) for queue in queues) if queues else 0):
+		order.extend(queue[i] for queue in queues if i < len(queue))
+	return order
+
+# the orders which can be chosen on the command line
+ORDERS = {
+	'downloads':byDownloads,
+	'size':bySize,
+	'stale':byStaleness,
+	'category':byCategory
+}
+
+def schedule(order, apps, todo):
+	""" Put apps in the order to process them.
+
+		Arguments:
+		order -- the name of an order in ORDERS, or None to keep the order of todo
+		apps  -- dictionary of apps and their meta data
+		todo  -- list of apps to process
+
+		Returns:
+		The list of apps to process, in order.
+		"""
+	if not order:
+		return list(todo)
+	return ORDERS[order](apps, todo)
@@ -0,0 +1,309 @@
+""" This file contains code for processing apps on many hosts at once.
+
+A coordinator browses the store and publishes the apps to process in a
+shared SQLite database. Workers on any number of hosts lease a few apps at
+a time from it, download and analyze them, and write each result back as
+soon as it is done. Leases of workers which die or stall expire and are
+handed out again. The coordinator merges the results into its cache as
+they come in, so the statistics are made from a single cache.
+
+Each run of the coordinator is recorded in the database as soon as it
+starts, before it browses the store, and marked as finished when all apps
+are done. A worker keeps waiting for work until the run which was going on
+when it started, or else the next one, is finished, so workers can be
+started before the coordinator has published anything.
+
+If an app is analyzed by more than one worker, an analysis result is
+preferred over the status of an app which hit a limit, which is preferred
+over a failure, and the worker with the lowest name breaks ties. The
+winner is chosen again whenever a result of the app arrives, so the merged
+cache does not depend on the order in which results arrive.
+"""
+
+import json
+import os
+import sqlite3
+import sys
+import time
+
+from analyze import storeResult
+from cache import *
+from pipeline import runPipeline
+from record import *
+
+from filesystem import *
+
+# how many times an app is leased before it is given up
+MAX_ATTEMPTS = 3
+
+# seconds to wait before looking for new leases or results again
+POLL_INTERVAL = 10
+
+SCHEMA = [
+	"""CREATE TABLE IF NOT EXISTS leases (
+		docid TEXT PRIMARY KEY,
+		version INTEGER,
+		offer INTEGER,
+		node TEXT,
+		expires REAL DEFAULT 0,
+		attempts INTEGER DEFAULT 0,
+		done INTEGER DEFAULT 0,
+		priority INTEGER DEFAULT 0
+	)""",
+	"CREATE TABLE IF NOT EXISTS results (docid TEXT, node TEXT, result TEXT, PRIMARY KEY (docid, node))",
+	"CREATE TABLE IF NOT EXISTS runs (run INTEGER PRIMARY KEY, finished INTEGER DEFAULT 0)",
+	"CREATE INDEX IF NOT EXISTS leases_free ON leases (done, expires)",
+	"CREATE INDEX IF NOT EXISTS leases_node ON leases (node, done)"
+]
+
+# columns added to tables after they were first created
+MIGRATIONS = [
+	('leases', 'priority', "ALTER TABLE leases ADD COLUMN priority INTEGER DEFAULT 0")
+]
+
+def openLeases(filename):
+	""" Open the shared database of leases and results, creating tables if needed.
+
+		Transactions are started explicitly, so leases are taken atomically
+		by concurrent workers.
+
+		Arguments:
+		filename -- the database file
+
+		Returns:
+		A database connection.
+		"""
+	db = sqlite3.connect(filename, timeout=60, isolation_level=None)
+	for statement in SCHEMA:
+		db.execute(statement)
+	for table,column,statement in MIGRATIONS:
+		if not column in [row[1] for row in db.execute("PRAGMA table_info(%s)" % table)]:
+			db.execute(statement)
+	db.execute("CREATE INDEX IF NOT EXISTS leases_priority ON leases (done, priority)")
+	return db
+
+def startRun(args):
+	""" Record that a coordinator has started, see waitingFor().
+
+		Arguments:
+		args -- the command line arguments object, the number of the run is kept as args.run
+		"""
+	db = openLeases(args.shard)
+	args.run = db.execute("INSERT INTO runs (finished) VALUES (0)").lastrowid
+	db.close()
+
+def finishRun(db, run):
+	""" Record that all apps of a run of the coordinator are done. """
+	db.execute("UPDATE runs SET finished = 1 WHERE run = ?", (run,))
+
+def waitingFor(db):
+	""" Get the run of the coordinator a worker which starts now waits for: the current run, or the next one if none is going on. """
+	row = db.execute("SELECT run, finished FROM runs ORDER BY run DESC LIMIT 1").fetchone()
+	if row is None:
+		return 1
+	run, finished = row
+	return run + 1 if finished else run
+
+def isFinished(db, run):
+	""" Check if a run of the coordinator, or a later one, is finished. """
+	return db.execute("SELECT COUNT(*) FROM runs WHERE run >= ? AND finished = 1", (run,)).fetchone()[0] > 0
+
+def publishApps(db, apps, todo):
+	""" Add apps to be processed by the workers.
+
+		Apps are leased in the order of todo. Apps which are already
+		published are only given their new place in that order, so the
+		coordinator can be restarted. Apps published with another version
+		are processed again, and the results of the old version are removed.
+
+		Arguments:
+		db   -- the database connection
+		apps -- dictionary of apps and their meta data
+		todo -- list of apps to process, in order
+
+		Returns:
+		The number of apps which were not published before, or were
+		published with another version.
+		"""
+	db.execute("BEGIN IMMEDIATE")
+	published = dict(db.execute("SELECT docid, version FROM leases"))
+	new = [app for app in todo if not app in published]
+	changed = [app for app in todo if app in published and published[app] != apps[app]['version']]
+	db.executemany("INSERT INTO leases (docid, version, offer) VALUES (?, ?, ?)",
+		[(app, apps[app]['version'], apps[app]['offer']) for app in new])
+	db.executemany("UPDATE leases SET version = ?, offer = ?, node = NULL, expires = 0, attempts = 0, done = 0 WHERE docid = ?",
+		[(apps[app]['version'], apps[app]['offer'], app) for app in changed])
+	db.executemany("DELETE FROM results WHERE docid = ?", [(app,) for app in changed])
+	db.executemany("UPDATE leases SET priority = ? WHERE docid = ? AND done = 0", [(i, app) for i,app in enumerate(todo)])
+	db.execute("COMMIT")
+	return len(new) + len(changed)
+
+def leaseApps(db, node, count, seconds):
+	""" Lease apps which are not done and not leased by another worker.
+
+		Arguments:
+		db      -- the database connection
+		node    -- the name of the worker
+		count   -- the number of apps to lease
+		seconds -- how long the lease lasts unless renewed
+
+		Returns:
+		A list of (app, version, offer), in the order the apps were published.
+		"""
+	now = time.time()
+	db.execute("BEGIN IMMEDIATE")
+	leased = db.execute("SELECT docid, version, offer FROM leases WHERE done = 0 AND expires < ? AND attempts < ? ORDER BY priority, docid LIMIT ?",
+		(now, MAX_ATTEMPTS, count)).fetchall()
+	db.executemany("UPDATE leases SET node = ?, expires = ?, attempts = attempts + 1 WHERE docid = ?",
+		[(node, now + seconds, app) for app,version,offer in leased])
+	db.execute("COMMIT")
+	return leased
+
+def reportResult(db, node, app, version, result, seconds):
+	""" Write the result of an app back and renew the other leases of the worker.
+
+		The result is dropped if the app was published with another version
+		since it was leased.
+
+		Arguments:
+		db      -- the database connection
+		node    -- the name of the worker
+		app     -- the ID of the app
+		version -- the version of the app which was analyzed
+		result  -- the result of the analysis, or None if it failed
+		seconds -- how long the renewed leases last
+		"""
+	db.execute("BEGIN IMMEDIATE")
+	if db.execute("SELECT COUNT(*) FROM leases WHERE docid = ? AND version = ?", (app, version)).fetchone()[0] > 0:
+		db.execute("INSERT OR REPLACE INTO results (docid, node, result) VALUES (?, ?, ?)", (app, node, json.dumps(result)))
+		db.execute("UPDATE leases SET done = 1 WHERE docid = ?", (app,))
+	db.execute("UPDATE leases SET expires = ? WHERE node = ? AND done = 0", (time.time() + seconds, node))
+	db.execute("COMMIT")
+
+def releaseApps(db, node):
+	""" Give back the apps a worker leased but could not process, so they can be leased again. """
+	db.execute("UPDATE leases SET expires = 0 WHERE node = ? AND done = 0", (node,))
+
+def remainingApps(db):
+	""" Get the number of apps which are not done and can still be leased or are being processed under a lease. """
+	return db.execute("SELECT COUNT(*) FROM leases WHERE done = 0 AND (attempts < ? OR expires >= ?)",
+		(MAX_ATTEMPTS, time.time())).fetchone()[0]
+
+def resultRank(node, result):
+	""" Get the key to sort the results of an app by, the first is merged. """
+	if not result:
+		return (2, node)
+	if 'status' in result:
+		return (1, node)
+	return (0, node)
+
+def isMerged(meta, result):
+	""" Check if a result is already stored in the meta data of an app, so it is not merged again. """
+	if meta.get('unchecked') or ('status' in meta and not 'status' in result):
+		return False
+	return all(meta.get(key) == value for key,value in result.iteritems())
+
+def mergeResults(db, apps, last = 0):
+	""" Merge the results which were written after a point into the apps.
+
+		For each app with new results, the best of all its results is
+		chosen (see resultRank) and stored, unless the app already has it.
+
+		Arguments:
+		db   -- the database connection
+		apps -- dictionary of apps and their meta data
+		last -- the last row of results merged before
+
+		Returns:
+		A tuple (merged, last) with the apps whose results were merged and
+		the last row of results, for the next call.
+		"""
+	rows = db.execute("SELECT rowid, docid FROM results WHERE rowid > ? ORDER BY rowid", (last,)).fetchall()
+	if not rows:
+		return ([], last)
+	merged = []
+	for app in sorted(set(docid for rowid,docid in rows)):
+		results = [(node, json.loads(result)) for node,result in db.execute("SELECT node, result FROM results WHERE docid = ?", (app,))]
+		node, result = min(results, key=lambda row: resultRank(*row))
+		if result and app in apps and not isMerged(apps[app], result):
+			storeResult(apps, app, result)
+			merged.append(app)
+	return (merged, rows[-1][0])
+
+def coordinate(args, apps, todo):
+	""" Publish apps for the workers and merge their results until all are done.
+
+		Arguments:
+		args -- the command line arguments object
+		apps -- dictionary of apps and their meta data
+		todo -- list of apps to process, in order
+		"""
+	db = openLeases(args.shard)
+	print "published {:,} new or changed apps for workers".format(publishApps(db, apps, todo))
+
+	last = 0
+	total = db.execute("SELECT COUNT(*) FROM leases").fetchone()[0]
+	while True:
+		merged, last = mergeResults(db, apps, last)
+		for app in merged:
+			saveApp(args, apps, app)
+		if merged and args.db:
+			commitCache(args, apps)
+
+		remaining = remainingApps(db)
+		sys.stdout.write("\rwaiting for workers... %6.2f%% %10s: %s\033[K " % (100.0 * (total - remaining) / max(total, 1), "left", remaining))
+		sys.stdout.flush()
+		if remaining == 0:
+			break
+		time.sleep(POLL_INTERVAL)
+
+	sys.stdout.write("\rdone waiting for workers\033[K\n")
+	sys.stdout.flush()
+	failed = db.execute("SELECT COUNT(*) FROM leases WHERE done = 0").fetchone()[0]
+	if failed > 0:
+		print "could not process {:,} apps after {} attempts".format(failed, MAX_ATTEMPTS)
+	finishRun(db, args.run)
+	print "saving to cache"
+	commitCache(args, apps)
+
+def runWorker(args, gpapi):
+	""" Process apps leased from the coordinator until its run is finished.
+
+		The shared database takes the place of the cache and the journal,
+		so the worker does not touch the cache of its own host.
+
+		Arguments:
+		args  -- the command line arguments object
+		gpapi -- the Google Play API object
+		"""
+	db = openLeases(args.shard)
+	run = waitingFor(db)
+	node = args.node
+	args.db = None
+	args.restore_freq = 0
+	journal = open(os.devnull, 'w')
+	createAppFolder(args)
+
+	processed = 0
+	while True:
+		leased = leaseApps(db, node, args.lease_size, args.lease_time)
+		if not leased:
+			if isFinished(db, run):
+				break
+			time.sleep(POLL_INTERVAL)
+			continue
+
+		apps = dict((app, AppRecord(version=version, offer=offer, unchecked=True)) for app,version,offer in leased)
+		report = lambda app, result: reportResult(db, node, app, apps[app]['version'], result, args.lease_time)
+		runPipeline(args, gpapi, apps, [app for app,version,offer in leased], journal, report)
+		commitResultCache(args)
+
+		# apps which could not be downloaded can be leased again, by this or another worker
+		releaseApps(db, node)
+		processed += len(leased)
+
+	sys.stdout.write("\rdone processing apps\033[K\n")
+	sys.stdout.flush()
+	print "leased {:,} apps as {}".format(processed, node)
+	journal.close()
+	deleteAppFolder(args)
@@ -1,9 +1,23 @@
 """ This file contains code for generating statistics from raw data. """
 
+import gc
+import operator
+import os
+import pickle
+import sqlite3
 import time
 
+import cache
+
+from record import AppRecord
+
+try:
+	import numpy
+except:
+	numpy = None
+
 from lists import *
-from numbers import *
+from numeric import *
 from strings import *
 
 def isBad(app):
@@ -53,12 +67,47 @@ def isNative(app):
 		"""
 	return (not isCustom(app) and not isBad(app))
 
+def classify(app):
+	""" Get how an app verifies certificates and hostnames.
+		
+		Arguments:
+		app -- dictionary with meta data of the app to classify
+		
+		Returns:
+		'bad', 'naive', 'custom' or 'native' (see isBad, isNaive and isCustom),
+		or None if the app has not been analyzed
+		"""
+	if not 'trustmanagers' in app:
+		return None
+	if isBad(app):
+		return 'bad'
+	if isNaive(app):
+		return 'naive'
+	if isCustom(app):
+		return 'custom'
+	return 'native'
+
+# classes of analyzed apps, see classify
+CLASSES = ['native', 'custom', 'naive', 'bad']
+
+# fields of a dictionary of statistics
+FIELDS = ['total', 'internet', 'trustmanagers', 'naive_trustmanagers',
+		  'insecure_factories','custom_hostname_verifiers','naive_hostname_verifiers',
+		  'allow_all_hostname_verifiers','ssl_error_handlers','unchecked','native', 'custom', 'naive', 'bad']
+
+# fields which count apps with at least one of something
+COUNTERS = ['trustmanagers', 'naive_trustmanagers', 'insecure_factories', 'custom_hostname_verifiers',
+			'naive_hostname_verifiers', 'allow_all_hostname_verifiers', 'ssl_error_handlers']
+
+# years which are always part of the statistics
+YEARS = ['Unknown', '2008', '2009', '2010', '2011', '2012', '2013']
+
+# apps whose meta data changed since the cache was loaded
+changedApps = set()
+
 def initStats(stats):
 	""" Initialize a dictionary of statistics. """
-	fields = ['total', 'internet', 'trustmanagers', 'naive_trustmanagers',
-			  'insecure_factories','custom_hostname_verifiers','naive_hostname_verifiers',
-			  'allow_all_hostname_verifiers','ssl_error_handlers','unchecked','native', 'custom', 'naive', 'bad']
-	for field in fields:
+	for field in FIELDS:
 		if not field in stats:
 			stats[field] = 0
 
@@ -92,20 +141,36 @@ def fillStats(app, meta, stats):
 		if not 'trustmanagers' in meta:
 			stats['unchecked'] += 1
 		else:
-			if isBad(meta):
-				stats['bad'] += 1
-			elif isNaive(meta):
-				stats['naive'] += 1
-			elif isCustom(meta):
-				stats['custom'] += 1
-			else:
-				stats['native'] += 1
+			stats[classify(meta)] += 1
 
-def calculateStatistics(apps):
+def yearOf(meta):
+	""" Get the year an app was released as a string. """
+	return str(meta['date'].tm_year) if meta['date'] else 'Unknown'
+
+def emptyStatistics():
+	""" Create the dictionary of statistics returned by calculateStatistics, without any apps. """
+	stats = {
+		'categories':{},
+		'downloads':dict((d, {}) for d in DOWNLOAD_RANGES),
+		'years':dict((y, {}) for y in YEARS),
+		'ratings':dict((r, {}) for r in RATING_RANGES),
+		'total':{}
+	}
+	for section in ['downloads', 'years', 'ratings']:
+		for key in stats[section]:
+			initStats(stats[section][key])
+	initStats(stats['total'])
+	return stats
+
+def calculateStatistics(apps, contributions = None):
 	""" Calculates the statistics of apps.
 		
+		The statistics are calculated with NumPy if it is installed.
+		
 		Arguments:
-		apps -- A dictionary with apps their meta data
+		apps          -- A dictionary with apps their meta data
+		contributions -- A dictionary which is filled with what each app adds to
+		                 the statistics, see contribution, or None
 		
 		Returns:
 		A dictionary with statistics:
@@ -115,57 +180,311 @@ def calculateStatistics(apps):
 		- years: statistics per year of release
 		- total: a summary
 		"""
-	categories = {}
-	total = {}
-	downloads = {'0-100':{}, '100-10,000':{}, '10,000-1,000,000':{}, '1,000,000-100,000,000':{}, '100,000,000+':{}}
-	years = {'Unknown':{},'2008':{},'2009':{},'2010':{},'2011':{},'2012':{},'2013':{}}
-	ratings = {'Unknown':{},'0-1':{},'1-2':{},'2-3':{},'3-4':{},'4-5':{}}
-	
-	# init some dictionaries
-	for download in downloads:
-		initStats(downloads[download])
-	for year in years:
-		initStats(years[year])
-	for rating in ratings:
-		initStats(ratings[rating])
+	if numpy is not None:
+		return calculateStatisticsColumnar(apps, contributions)
 	
+	stats = emptyStatistics()
 	for app,meta in apps.iteritems():
-		_d = "{:,}+".format(int(meta['downloads']))
-		_t = meta['title']
-		_a = meta['creator']
-		try:
-			_a = meta['creator'].encode('utf-8')
-		except:
-			None
-		try:
-			_t = meta['title'].encode('utf-8')
-		except:
-			None
+		if contributions is not None:
+			contributions[app] = contribution(meta)
 		
 		# total
-		fillStats(app, meta, total)
+		fillStats(app, meta, stats['total'])
 		
 		# year
-		year = time.strftime("%Y", meta['date']) if meta['date'] else 'Unknown'
-		fillStats(app, meta, years[year])
+		year = yearOf(meta)
+		if not year in stats['years']:
+			stats['years'][year] = {}
+		fillStats(app, meta, stats['years'][year])
 		
 		# rating
-		fillStats(app, meta, ratings[ratingRange(meta)])
+		fillStats(app, meta, stats['ratings'][ratingRange(meta)])
 		
 		# downloads
-		fillStats(app, meta, downloads[downloadRange(meta)])
+		fillStats(app, meta, stats['downloads'][downloadRange(meta)])
 		
 		# categories
 		for cat in meta['categories']:
 			category = cat[0]
-			if not category in categories:
-				categories[category] = {}
-			fillStats(app, meta, categories[category])
+			if not category in stats['categories']:
+				stats['categories'][category] = {}
+			fillStats(app, meta, stats['categories'][category])
+	
+	return stats
+
+def calculateStatisticsColumnar(apps, contributions = None):
+	""" Calculates the statistics of apps using NumPy.
+		
+		The fields of all apps are packed into arrays once, the
+		classification of apps is done on whole arrays at once, and each
+		breakdown is a weighted count per group. The result is the same as
+		for calculateStatistics.
+		
+		Arguments:
+		apps          -- A dictionary with apps their meta data
+		contributions -- A dictionary which is filled with what each app adds to
+		                 the statistics, see contribution, or None
+		
+		Returns:
+		A dictionary with statistics, see calculateStatistics.
+		"""
+	metas = apps.values()
+	n = len(metas)
+	
+	# pack fields into arrays, without the garbage collector going through
+	# all apps again and again while the temporary lists are built
+	collecting = gc.isenabled()
+	gc.disable()
+	try:
+		if n > 0 and isinstance(metas[0], AppRecord):
+			# records are read directly, and their days converted to years all at once
+			columns = zip(*map(operator.attrgetter('internet', 'downloads', 'rating', 'days', 'categories'), metas))
+			days = numpy.array([-1 if d is None else d for d in columns[3]], dtype=numpy.int64)
+			years = numpy.where(days < 0, 0, days.astype('datetime64[D]').astype('datetime64[Y]').astype(numpy.int64) + 1970)
+			checked = numpy.array(map(lambda meta: hasattr(meta, 'trustmanagers'), metas), dtype=bool)
+			counters = numpy.array(map(lambda meta: [getattr(meta, counter, 0) for counter in COUNTERS], metas), dtype=numpy.int64).reshape(n, len(COUNTERS)).T
+		else:
+			columns = zip(*map(operator.itemgetter('internet', 'downloads', 'rating', 'date', 'categories'), metas)) or [()] * 5
+			years = numpy.array([date.tm_year if date else 0 for date in columns[3]], dtype=numpy.int64).reshape(n)
+			checked = numpy.array(map(operator.methodcaller('__contains__', 'trustmanagers'), metas), dtype=bool).reshape(n)
+			counters = numpy.array(map(lambda meta: [meta.get(counter, 0) for counter in COUNTERS], metas), dtype=numpy.int64).reshape(n, len(COUNTERS)).T
+		internet = numpy.array(columns[0], dtype=bool).reshape(n)
+		downloads = numpy.array(columns[1]).astype(numpy.int64).reshape(n)
+		ratings = numpy.array(columns[2], dtype=float).reshape(n)
+		
+		# number the categories, an app is counted once per subcategory it is found in
+		categoryIndex = {}
+		members = []
+		categories = []
+		for i,cats in enumerate(columns[4]):
+			for cat in cats:
+				members.append(i)
+				categories.append(categoryIndex.setdefault(cat[0], len(categoryIndex)))
+		categoryNames = sorted(categoryIndex, key=categoryIndex.get)
+		members = numpy.array(members, dtype=numpy.int64)
+		categories = numpy.array(categories, dtype=numpy.int64)
+	finally:
+		if collecting:
+			gc.enable()
+	
+	# number the years
+	yearValues, years = numpy.unique(numpy.concatenate([[0] + map(int, YEARS[1:]), years]), return_inverse=True)
+	years = years[len(YEARS):]
+	yearNames = [str(y) if y else 'Unknown' for y in yearValues]
+	
+	# classify apps
+	present = counters > 0
+	has = dict((counter, present[c]) for c,counter in enumerate(COUNTERS))
+	analyzed = internet & checked
+	bad = analyzed & (has['insecure_factories'] | has['allow_all_hostname_verifiers'])
+	naive = analyzed & ~bad & (has['naive_trustmanagers'] | has['naive_hostname_verifiers'])
+	custom = analyzed & ~bad & ~naive & (has['trustmanagers'] | has['custom_hostname_verifiers'])
+	masks = {
+		'total':numpy.ones(n, dtype=bool),
+		'internet':internet,
+		'unchecked':internet & ~checked,
+		'bad':bad,
+		'naive':naive,
+		'custom':custom,
+		'native':analyzed & ~bad & ~naive & ~custom
+	}
+	for counter in COUNTERS:
+		masks[counter] = internet & has[counter]
+	
+	def group(groups, names, index = None):
+		""" Count the apps of each field per group. """
+		result = dict((name, {}) for name in names)
+		for field in FIELDS:
+			weights = masks[field] if index is None else masks[field][index]
+			counts = numpy.bincount(groups, weights=weights, minlength=len(names))
+			for g,name in enumerate(names):
+				result[name][field] = int(counts[g])
+		return result
+	
+	# rating ranges are 0-1, 1-2, ... 4-5 with the upper bound included
+	ratingGroups = numpy.where((ratings >= 0) & (ratings <= 5), numpy.maximum(numpy.ceil(ratings) - 1, 0), len(RATING_RANGES) - 1).astype(numpy.int64)
+	downloadGroups = numpy.searchsorted(numpy.array([100, 10000, 1000000, 100000000]), downloads, side='right')
+	
+	if contributions is not None:
+		bits = numpy.zeros(n, dtype=numpy.int64)
+		for i,field in enumerate(FIELDS):
+			bits |= masks[field].astype(numpy.int64) << i
+		contributions.update(zip(apps.keys(), zip(
+			[yearNames[y] for y in years.tolist()],
+			[RATING_RANGES[r] for r in ratingGroups.tolist()],
+			[DOWNLOAD_RANGES[d] for d in downloadGroups.tolist()],
+			[tuple(cat[0] for cat in cats) for cats in columns[4]],
+			bits.tolist())))
 	
 	return {
-		'categories':categories,
-		'downloads':downloads,
-		'years':years,
-		'ratings':ratings,
-		'total':total
-	}
\ No newline at end of file
+		'categories':group(categories, categoryNames, members),
+		'downloads':group(downloadGroups, DOWNLOAD_RANGES),
+		'years':group(years, yearNames),
+		'ratings':group(ratingGroups, RATING_RANGES),
+		'total':group(numpy.zeros(n, dtype=numpy.int64), ['total'])['total']
+	}
+
+def markChanged(app):
+	""" Remember that the meta data of an app changed, so its statistics are updated.
+		
+		Arguments:
+		app -- the ID of the app
+		"""
+	changedApps.add(app)
+
+def contribution(meta):
+	""" Get what an app adds to the statistics.
+		
+		Arguments:
+		meta -- meta data for app
+		
+		Returns:
+		A tuple with the year, rating range, download range and categories of
+		the app, and a bitmask of the fields in FIELDS it counts towards.
+		"""
+	fields = {}
+	fillStats(None, meta, fields)
+	bits = 0
+	for i,field in enumerate(FIELDS):
+		if fields[field]:
+			bits |= 1 << i
+	return (yearOf(meta), ratingRange(meta), downloadRange(meta), tuple(cat[0] for cat in meta['categories']), bits)
+
+def addContribution(stats, c, sign = 1):
+	""" Add (or subtract) what an app adds to the statistics.
+		
+		Groups which have no apps left are removed, like they would be
+		missing from a fresh calculation.
+		
+		Arguments:
+		stats -- dictionary with statistics, see calculateStatistics
+		c     -- the contribution of the app, see contribution
+		sign  -- 1 to add the app, -1 to subtract it
+		"""
+	year, rating, downloads, categories, bits = c
+	for section,key in [('years', year)] + [('categories', cat) for cat in categories]:
+		if not key in stats[section]:
+			stats[section][key] = {}
+			initStats(stats[section][key])
+	groups = [stats['total'], stats['years'][year], stats['ratings'][rating], stats['downloads'][downloads]]
+	groups.extend(stats['categories'][cat] for cat in categories)
+	for i,field in enumerate(FIELDS):
+		if bits & (1 << i):
+			for group in groups:
+				group[field] += sign
+	if stats['years'][year]['total'] == 0 and not year in YEARS:
+		del stats['years'][year]
+	for cat in categories:
+		if cat in stats['categories'] and stats['categories'][cat]['total'] == 0:
+			del stats['categories'][cat]
+
+def mergeStatistics(a, b):
+	""" Merge the statistics of two disjoint sets of apps.
+		
+		Arguments:
+		a -- dictionary with statistics, see calculateStatistics
+		b -- dictionary with statistics, see calculateStatistics
+		
+		Returns:
+		A dictionary with the statistics of all apps.
+		"""
+	merged = emptyStatistics()
+	for stats in [a, b]:
+		for field in FIELDS:
+			merged['total'][field] += stats['total'][field]
+		for section in ['categories', 'downloads', 'years', 'ratings']:
+			for key,group in stats[section].iteritems():
+				if not key in merged[section]:
+					merged[section][key] = {}
+					initStats(merged[section][key])
+				for field in FIELDS:
+					merged[section][key][field] += group[field]
+	return merged
+
+def openStatsCache(filename):
+	""" Open the database of saved statistics, creating tables if needed.
+		
+		It holds the statistics together with the cache stamp they belong
+		to, and what each app added to them, one row per app, so the
+		contributions of changed apps can be looked up and replaced without
+		reading the others.
+		
+		Arguments:
+		filename -- the database file
+		
+		Returns:
+		A database connection.
+		"""
+	db = sqlite3.connect(filename)
+	db.execute("CREATE TABLE IF NOT EXISTS summary (stamp BLOB, stats BLOB)")
+	db.execute("CREATE TABLE IF NOT EXISTS contributions (docid TEXT PRIMARY KEY, year TEXT, rating TEXT, downloads TEXT, categories TEXT, bits INTEGER)")
+	return db
+
+def contributionRow(app, c):
+	""" Get the row of the contributions table of an app, see contribution. """
+	year, rating, downloads, categories, bits = c
+	return (app, year, rating, downloads, "\t".join(categories), bits)
+
+def lookupContribution(db, app):
+	""" Get the saved contribution of an app, or None if it has none. """
+	row = db.execute("SELECT year, rating, downloads, categories, bits FROM contributions WHERE docid = ?", (app,)).fetchone()
+	if row is None:
+		return None
+	year, rating, downloads, categories, bits = row
+	return (str(year), str(rating), str(downloads), tuple(str(cat) for cat in categories.split("\t") if cat), bits)
+
+def updateStatistics(args, apps):
+	""" Get the statistics of apps, only recalculating what changed.
+		
+		The statistics are saved together with what each app added to them,
+		so when apps change only their old contribution is subtracted and
+		their new one added, which only reads and writes the rows of the
+		changed apps. Everything is recalculated if the saved statistics do
+		not belong to the cache which was loaded.
+		
+		Arguments:
+		args -- command line argument object
+		apps -- dictionary with apps and their meta data
+		
+		Returns:
+		A dictionary with statistics, see calculateStatistics.
+		"""
+	try:
+		db = openStatsCache(args.stats_cache)
+		summary = db.execute("SELECT stamp, stats FROM summary").fetchone()
+	except sqlite3.DatabaseError:
+		# not a database, e.g. saved by an older version
+		os.remove(args.stats_cache)
+		db = openStatsCache(args.stats_cache)
+		summary = None
+	
+	if summary is None or cache.loadedStamp is None or pickle.loads(str(summary[0])) != cache.loadedStamp:
+		contributions = {}
+		stats = calculateStatistics(apps, contributions)
+		db.execute("DELETE FROM contributions")
+		db.executemany("INSERT INTO contributions (docid, year, rating, downloads, categories, bits) VALUES (?, ?, ?, ?, ?, ?)",
+			(contributionRow(app, c) for app,c in contributions.iteritems()))
+	elif changedApps:
+		stats = pickle.loads(str(summary[1]))
+		for app in changedApps:
+			old = lookupContribution(db, app)
+			if old is not None:
+				addContribution(stats, old, -1)
+			if app in apps:
+				c = contribution(apps[app])
+				addContribution(stats, c)
+				db.execute("INSERT OR REPLACE INTO contributions (docid, year, rating, downloads, categories, bits) VALUES (?, ?, ?, ?, ?, ?)",
+					contributionRow(app, c))
+			else:
+				db.execute("DELETE FROM contributions WHERE docid = ?", (app,))
+	else:
+		return pickle.loads(str(summary[1]))
+	
+	changedApps.clear()
+	db.execute("DELETE FROM summary")
+	db.execute("INSERT INTO summary (stamp, stats) VALUES (?, ?)", (
+		sqlite3.Binary(pickle.dumps(cache.cacheStamp(args), pickle.HIGHEST_PROTOCOL)),
+		sqlite3.Binary(pickle.dumps(stats, pickle.HIGHEST_PROTOCOL))))
+	db.commit()
+	db.close()
+	return stats
@@ -1,22 +1,48 @@
 """ This file contains code for accessing the Google Play Store. """
 
-import pickle
+import errno
+import hashlib
+import json
+import os
+import socket
 import time
 import urlparse
 import sys
+import threading
 
+# time.strptime imports this on first use, which fails if several threads do it at once
+import _strptime
+
+from multiprocessing.pool import ThreadPool
+
+from cache import *
 from output import *
 
 # Do not remove
 GOOGLE_LOGIN = GOOGLE_PASSWORD = AUTH_TOKEN = None
 
+# same headers as GooglePlayAPI uses when downloading
+DOWNLOAD_HEADERS = {
+	"User-Agent" : "AndroidDownloadManager/4.1.1 (Linux; U; Android 4.1.1; Nexus S Build/JRO03E)",
+	"Accept-Encoding": ""
+}
+
+# only needed for the real store, the fake store works without them
 try:
+	import googleplay
 	from googleplay import GooglePlayAPI
-except:
-	print("error: could not find GooglePlayAPI, make sure you have downloaded it and set your python path.")
-	exit(1)
+	import requests
+	from client import *
+except ImportError:
+	googleplay = None
+
+from retry import *
+from metrics import *
+from record import *
+
+from filesystem import *
 
-def login(id, mail, password, token):
+def login(id, mail, password, token, retries = 5, timeout = 60):
 	""" Login to the Google Play Store.
 		
 		You can either specify the mail and password, or use
@@ -27,11 +53,21 @@ def login(id, mail, password, token):
 		mail     -- the email address of the account
 		password -- the password of the account
 		token    -- a valid auth token
+		retries  -- how many times to retry a failed request
+		timeout  -- how many seconds to wait for a response
 		
 		Returns:
 		A Google Play API object.
 		"""
-	api = GooglePlayAPI(id)
+	if googleplay is None:
+		print("error: could not find GooglePlayAPI, make sure you have downloaded it and set your python path.")
+		exit(1)
+	
+	# make GooglePlayAPI reuse connections
+	http = PooledRequests(timeout)
+	googleplay.requests = http
+	
+	api = PlayClient(GooglePlayAPI(id), http, retries, TRANSIENT_ERRORS)
 	api.login(mail, password, token)
 	return api
 
@@ -54,27 +90,104 @@ def constructLimitsOffsets(limit, offset):
 	return limitOffsets
 
 
+def getDeliveryData(gpAPI, app, version, offer):
+	""" Get the location of the apk of an app on the Google Play Store.
+		
+		Arguments:
+		gpAPI      -- Google Play API object
+		app        -- the ID of the app
+		version    -- the version code of the app
+		offer      -- the offer type of the app
+		
+		Returns:
+		A tuple with the download URL and the cookies needed to access it.
+		"""
+	message = gpAPI.executeRequestApi2("purchase", "ot=%d&doc=%s&vc=%d" % (offer, app, version))
+	data = message.payload.buyResponse.purchaseStatusResponse.appDeliveryData
+	cookie = data.downloadAuthCookie[0]
+	return data.downloadUrl, {str(cookie.name): str(cookie.value)}
+
+def fetchApk(http, url, cookies, partial, chunk_size = 65536):
+	""" Download an apk to a partial file.
+		
+		The apk is written to disk one chunk at a time while it is hashed, so
+		memory use does not depend on the size of the apk. If the partial file
+		already exists, only the rest of the apk is requested.
+		
+		Arguments:
+		http       -- the requests module or a replacement for it
+		url        -- the download URL of the apk
+		cookies    -- the cookies needed to access the URL
+		partial    -- the file to write to
+		chunk_size -- the number of bytes to read and write at a time
+		
+		Returns:
+		The SHA-256 of the apk as a hex string.
+		"""
+	headers = dict(DOWNLOAD_HEADERS)
+	offset = os.path.getsize(partial) if os.path.isfile(partial) else 0
+	if offset > 0:
+		headers['Range'] = "bytes=%d-" % offset
+	response = http.get(url, headers=headers, cookies=cookies, verify=False, stream=True)
+	
+	sha256 = hashlib.sha256()
+	if response.status_code == 206:
+		with open(partial, 'rb') as f:
+			for chunk in iter(lambda: f.read(chunk_size), ''):
+				sha256.update(chunk)
+		mode = 'ab'
+	elif response.status_code == 200:
+		offset = 0
+		mode = 'wb'
+	else:
+		# the partial file is no good, start over
+		if offset > 0:
+			os.remove(partial)
+		raise IOError("download failed with status %d" % response.status_code)
+	
+	with open(partial, mode) as f:
+		for chunk in response.iter_content(chunk_size):
+			f.write(chunk)
+			sha256.update(chunk)
+	
+	# the connection may be closed before everything was sent
+	length = response.headers.get('content-length')
+	if length and os.path.getsize(partial) != offset + int(length):
+		raise socket.error(errno.ECONNRESET, "download was interrupted")
+	
+	return sha256.hexdigest()
+
 def download(gpAPI, path, app, version, offer):
 	""" Download an app from the Google Play Store.
 		
+		If gpAPI is a PlayClient, a download which fails is retried and
+		resumed where it stopped.
+		
 		Arguments:
 		gpAPI      -- Google Play API object
-		path       -- the category to fetch apps from
-		app        -- the subcategory to fetch apps from
-		version    -- the dictionary where apps with INTERNET permission are saved (detailed meta data)
-		offer      -- a dictionary with all apps found (no meta data)
+		path       -- the filename to save the apk as
+		app        -- the ID of the app
+		version    -- the version code of the app
+		offer      -- the offer type of the app
 		
 		Returns:
-		True if the app was downloaded successfully, otherwise false.
+		The SHA-256 of the apk as a hex string if the app was downloaded successfully, otherwise None.
 		"""
+	partial = path + ".part"
 	try:
-		data = gpAPI.download(app, version, offer)
-		f = open(path, "wb")
-		f.write(data)
-		f.close()
-		return True
+		url, cookies = getDeliveryData(gpAPI, app, version, offer)
+		if isinstance(gpAPI, PlayClient):
+			digest = gpAPI.call('download', fetchApk, gpAPI.http, url, cookies, partial)
+		else:
+			digest = fetchApk(requests, url, cookies, partial)
+		os.rename(partial, path)
+		return digest
 	except:
-		return False
+		try:
+			os.remove(partial)
+		except:
+			None
+		return None
 
 def getCategories(gpAPI):
 	""" Get a list of all categories on the play store.
@@ -108,7 +221,95 @@ def getSubcategories(gpAPI, category):
 		subcatIDs.append(subcat.docid.encode('utf-8'))
 	return subcatIDs
 
-def getApps(gpAPI, cat, subcat, apps, limit = 500, offset = 0):
+def addCategory(apps, docid, cat, subcat):
+	""" Add a category/subcategory to the list of categories an app is found in. """
+	if apps[docid].addCategory(cat, subcat):
+		markChanged(docid)
+
+def getDetails(gpAPI, docids, batch = 100):
+	""" Get the details of a list of apps.
+		
+		The apps are looked up in bulk, a batch of apps per request, if the
+		API supports it. Otherwise one request is made per app.
+		
+		Arguments:
+		gpAPI  -- Google Play API object
+		docids -- the IDs of the apps
+		batch  -- the number of apps to look up per request
+		
+		Returns:
+		A dictionary of app IDs and their details, apps which could not be found are left out.
+		"""
+	details = {}
+	if batch > 1 and hasattr(gpAPI, 'bulkDetails'):
+		for i in xrange(0, len(docids), batch):
+			with timer('details'):
+				response = gpAPI.bulkDetails(docids[i:i+batch])
+			for entry in response.entry:
+				if entry.doc.docid:
+					details[entry.doc.docid] = entry.doc
+	else:
+		for docid in docids:
+			with timer('details'):
+				details[docid] = gpAPI.details(docid).docV2
+	return details
+
+def createMeta(app, details):
+	""" Create the meta data of an app.
+		
+		Arguments:
+		app     -- the app as found in an app list
+		details -- the details of the app
+		
+		Returns:
+		An AppRecord with the meta data of the app, without categories.
+		"""
+	meta = AppRecord(**{
+		'title':app.title.encode('utf-8'),
+		'creator':app.creator.encode('utf-8'),
+		'super_dev':len(app.annotations.badgeForCreator),
+		'price':app.offer[0].formattedAmount,
+		'downloads':re.sub("[^0-9]", "", app.details.appDetails.numDownloads),
+		'version':details.details.appDetails.versionCode,
+		'offer':details.offer[0].offerType,
+		'rating':app.aggregateRating.starRating,
+		'date':time.strptime(details.details.appDetails.uploadDate, "%b %d, %Y"),
+		'size':details.details.appDetails.installationSize,
+		'unchecked':True
+	})
+	internet = any("android.permission.INTERNET" in i for i in details.details.appDetails.permission)
+	meta['internet'] = internet
+	return meta
+
+def hasChanged(meta, app):
+	""" Check if an app has changed since its meta data was created.
+		
+		The version code and upload date given in app lists are compared
+		with the meta data. Apps whose list entry does not give them, or
+		which are still being looked up, are taken to be unchanged.
+		
+		Arguments:
+		meta -- the meta data of the app
+		app  -- the app as found in an app list
+		
+		Returns:
+		True if the app has a different version or upload date.
+		"""
+	if not 'version' in meta:
+		return False
+	hints = app.details.appDetails
+	version = getattr(hints, 'versionCode', 0)
+	if version and version != meta['version']:
+		return True
+	date = getattr(hints, 'uploadDate', '')
+	if date:
+		try:
+			return toDays(time.strptime(date, "%b %d, %Y")) != toDays(meta.get('date'))
+		except ValueError:
+			return False
+	return False
+
+def getApps(gpAPI, cat, subcat, apps, limit = 500, offset = 0, lock = None, batch = 100, delta = False):
 	""" Get a list of all apps in a subcategory.
 		
 		Arguments:
@@ -118,6 +319,12 @@ def getApps(gpAPI, cat, subcat, apps, limit = 500, offset = 0):
 		apps       -- the dictionary with apps and their meta data
 		limit      -- the number of apps to fetch (no more than 500)
 		offset     -- the offset to start fetching from
+		lock       -- lock protecting apps when several subcategories are fetched at once
+		batch      -- the number of apps to look up per details request
+		delta      -- whether to look up the details of known apps again if they have changed
+		
+		Returns:
+		The number of known apps which had changed and were looked up again.
 		"""
 	
 	if limit + offset > 500:
@@ -129,6 +336,9 @@ def getApps(gpAPI, cat, subcat, apps, limit = 500, offset = 0):
 	if offset < 0:
 		raise LookupError("Offset cannot be less than zero.")
 	
+	if lock is None:
+		lock = threading.Lock()
+	
 	# we can only fetch 100 apps at a time, so we need to construct
 	# a list of offsets and limits
 	limitsOffsets = constructLimitsOffsets(limit, offset)
@@ -136,45 +346,79 @@ def getApps(gpAPI, cat, subcat, apps, limit = 500, offset = 0):
 	# will overwrite two previous characters
 	animate()
 	
+	refreshed = 0
 	for limitOffset in limitsOffsets:
 		limit = limitOffset[0]
 		offset = limitOffset[1]
-		list = gpAPI.list(cat, subcat, limit, offset)
+		with timer('list'):
+			list = gpAPI.list(cat, subcat, limit, offset)
 		
+		# an empty list has no documents, there are no more apps after it
 		try:
-			for app in list.doc[0].child:
-				animate()
-				
-				if app.docid in apps:
-					if not (cat,subcat) in apps[app.docid]['categories']:
-						apps[app.docid]['categories'].append((cat, subcat))
-				else:
-					details = gpAPI.details(app.docid)
-					meta = {
-						'title':app.title.encode('utf-8'),
-						'creator':app.creator.encode('utf-8'),
-						'super_dev':len(app.annotations.badgeForCreator),
-						'price':app.offer[0].formattedAmount,
-						'downloads':re.sub("[^0-9]", "", app.details.appDetails.numDownloads),
-						'version':details.docV2.details.appDetails.versionCode,
-						'offer':details.docV2.offer[0].offerType,
-						'rating':app.aggregateRating.starRating,
-						'date':time.strptime(details.docV2.details.appDetails.uploadDate, "%b %d, %Y"),
-						'unchecked':True,
-						'categories':[(cat, subcat)]
-					}
-					internet = any("android.permission.INTERNET" in i for i in details.docV2.details.appDetails.permission)
-					meta['internet'] = internet
-					apps[app.docid] = meta
-				apps[app.docid]['foo'] = False
+			entries = list.doc[0].child
 		except IndexError:
-			#sys.stdout.write('e')
-			#sys.stdout.flush()
 			break
+		
+		new = []
+		changed = []
+		for app in entries:
+			animate()
+			
+			with lock:
+				if app.docid in apps:
+					addCategory(apps, app.docid, cat, subcat)
+					if delta and hasChanged(apps[app.docid], app):
+						changed.append(app)
+				else:
+					# reserve the app so other subcategories only add their category
+					apps[app.docid] = AppRecord(categories=[(cat, subcat)])
+					new.append(app)
+		
+		try:
+			details = getDetails(gpAPI, [app.docid for app in new + changed], batch)
+			metas = [(app, createMeta(app, details[app.docid])) for app in new if app.docid in details]
+			updates = [(app, createMeta(app, details[app.docid])) for app in changed if app.docid in details]
+		except:
+			with lock:
+				for app in new:
+					del apps[app.docid]
+			raise
+		
+		with lock:
+			for app in new:
+				if not app.docid in details:
+					del apps[app.docid]
+			for app,meta in metas:
+				meta['categories'] = apps[app.docid]['categories']
+				apps[app.docid] = meta
+				markChanged(app.docid)
+			
+			# the new meta data marks the app as unchecked, the old results are kept until it is analyzed again
+			for app,meta in updates:
+				apps[app.docid].update(meta)
+				markChanged(app.docid)
+			refreshed += len(updates)
+	
+	return refreshed
+
+def loadCrawlState(args):
+	""" Get when each subcategory was last fetched, as a dictionary of 'category/subcategory' and seconds since 1970. """
+	try:
+		return json.load(open(args.crawl_state))
+	except:
+		return {}
+
+def saveCrawlState(args, state):
+	""" Save when each subcategory was last fetched, see loadCrawlState. """
+	writeIfChanged(args.crawl_state, json.dumps(state, indent=1, sort_keys=True))
 
 def browse(args, gpapi, apps):
 	""" Browse Google Play Store and construct list of apps to analyze.
 		
+		In delta mode the details of known apps are only looked up again if
+		their list entries show a new version, and subcategories fetched
+		less than args.recrawl_after hours ago are skipped.
+		
 		Arguments:
 		args  -- command line argument object
 		gpapi -- Google Play API object
@@ -187,25 +431,63 @@ def browse(args, gpapi, apps):
 		for category in getCategories(gpapi):
 			categories[category] = []
 	
-	for category in categories:
+	pool = ThreadPool(max(1, args.crawl_threads))
+	try:
 		if args.subcategory and args.subcategory != "all":
-			categories[category] = [args.subcategory]
+			for category in categories:
+				categories[category] = [args.subcategory]
 		else:
-			categories[category] = getSubcategories(gpapi, category)
-	
-	num = len([subcategory for subcategory in categories[category] for category in categories])
-	i = 0
-	for category in categories:
-		for subcategory in categories[category]:
+			subcategories = pool.map(lambda category: getSubcategories(gpapi, category), categories.keys())
+			for category,subcats in zip(categories.keys(), subcategories):
+				categories[category] = subcats
+		
+		pairs = [(category, subcategory) for category in categories for subcategory in categories[category]]
+		lock = threading.Lock()
+		
+		state = {}
+		if args.delta:
+			state = loadCrawlState(args)
+			recent = [pair for pair in pairs if time.time() - state.get("%s/%s" % pair, 0) < args.recrawl_after * 3600]
+			if recent:
+				print "skipping {:,} subcategories fetched less than {} hours ago".format(len(recent), args.recrawl_after)
+				pairs = [pair for pair in pairs if not pair in recent]
+		
+		# a subcategory which cannot be fetched is skipped, the others are still fetched
+		def fetch(pair):
+			try:
+				return (pair, getApps(gpapi, pair[0], pair[1], apps, args.limit, args.offset, lock, args.details_batch, args.delta), None)
+			except Exception as e:
+				return (pair, 0, e)
+		
+		i = 0
+		refreshed = 0
+		failed = 0
+		for (category,subcategory),changed,error in pool.imap_unordered(fetch, pairs):
 			i += 1
 			cat_str = "%s/%s:" % (category, subcategory)
-			sys.stdout.write("\rfetching app list in category {:<50} {:6.2f}% {} ".format(cat_str, 100.0 * i / num, animation[animation_pos % len(animation)]))
+			if error:
+				failed += 1
+				sys.stdout.write("\rerror: could not fetch app list in category {} {}\033[K\n".format(cat_str, error))
+			else:
+				refreshed += changed
+				if args.delta:
+					state["%s/%s" % (category, subcategory)] = time.time()
+			sys.stdout.write("\rfetching app list in category {:<50} {:6.2f}% {} ".format(cat_str, 100.0 * i / len(pairs), animation[animation_pos % len(animation)]))
 			sys.stdout.flush()
-			getApps(gpapi, category, subcategory, apps, args.limit, args.offset)
+	finally:
+		pool.close()
+		pool.join()
 	
 	sys.stdout.write("\rdone fetching app lists\033[K\n")
 	sys.stdout.flush()
+	if failed > 0:
+		print "could not fetch {:,} app lists".format(failed)
+	if args.delta:
+		print "found {:,} apps with a new version".format(refreshed)
 	
-	# save cache
+	# save cache, and only then which subcategories were fetched, so they are
+	# fetched again if their apps were not saved
 	print "saving to cache"
-	pickle.dump(apps, open(args.f_cache, 'wb'))
+	saveCache(args, apps)
+	if args.delta:
+		saveCrawlState(args, state)
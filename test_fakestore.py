@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+""" Smoke test of crawling and downloading from the fake store.
+
+Only needs the standard library, run as: python test_fakestore.py
+"""
+
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'utilities'))
+
+from fakestore import fakeLogin
+from store import download, getApps, getCategories, getSubcategories
+
+class FakeStoreTest(unittest.TestCase):
+
+	def setUp(self):
+		self.api = fakeLogin("apps=50,categories=5,subcategories=2,size=20000")
+		self.folder = tempfile.mkdtemp()
+
+	def tearDown(self):
+		self.api.server.shutdown()
+		shutil.rmtree(self.folder)
+
+	def test_crawl_and_download(self):
+		apps = {}
+		for cat in getCategories(self.api):
+			for subcat in getSubcategories(self.api, cat):
+				getApps(self.api, cat, subcat, apps, 100)
+		self.assertEqual(len(apps), 50)
+		self.assertTrue(all(meta['version'] and meta['size'] for meta in apps.values()))
+
+		for app in sorted(apps)[:5]:
+			path = os.path.join(self.folder, app + ".apk")
+			digest = download(self.api, path, app, apps[app]['version'], apps[app]['offer'])
+			self.assertEqual(os.path.getsize(path), self.api.appSize(app))
+			self.assertEqual(digest, hashlib.sha256(open(path, 'rb').read()).hexdigest())
+
+if __name__ == "__main__":
+	unittest.main()
@@ -1,7 +1,10 @@
 """ This file contains code for working with the local filesystem. """
 
+import hashlib
+import json
 import os
-import pickle
+
+from cache import *
 
 def createTexFolder(args):
 	""" Create the folder for storing generated LaTeX reports.
@@ -45,42 +48,120 @@ def deleteAppFolder(args):
 	except:
 		None
 
+def writeIfChanged(filename, content):
+	""" Write content to a file, unless the file already has that content.
+		
+		The content is written to a temporary file which is then renamed,
+		so the file is never left half written.
+		
+		Arguments:
+		filename -- the file to write
+		content  -- the string to write
+		
+		Returns:
+		A tuple with the SHA-256 hash of the content and whether the file was written.
+		"""
+	digest = hashlib.sha256(content).hexdigest()
+	try:
+		with open(filename, 'rb') as file:
+			if hashlib.sha256(file.read()).hexdigest() == digest:
+				return (digest, False)
+	except:
+		None
+	
+	with open(filename + ".tmp", 'wb') as file:
+		file.write(content)
+	os.rename(filename + ".tmp", filename)
+	return (digest, True)
+
 def getRestorePoint(args):
-	""" Get the point from where to resume app analyzing.
+	""" Get the apps which were already processed before the analyzer stopped.
+		
+		The journal is read line by line and an incomplete last line, left
+		by a crash in the middle of a write, is ignored.
 		
 		Arguments:
 		args -- the command line arguments object
 		
 		Returns:
-		The position where to resume
+		A dictionary of processed (app ID, version) and their results (None if the app could not be analyzed)
 		"""
+	journal = {}
 	try:
-		pos = pickle.load(open(args.f_pos, 'rb'))
-		print "resuming from restore point at: " + str(pos)
-		return pos
+		for line in open(args.f_journal, 'r'):
+			try:
+				entry = json.loads(line)
+				journal[(entry['app'], entry.get('version'))] = entry['result']
+			except:
+				None
 	except:
-		return 0
+		return journal
+	print "resuming from restore point with {:,} processed apps".format(len(journal))
+	return journal
 
-def createRestorePoint(args, apps, pos):
-	""" Create a point for resuming analyzing.
+def openJournal(args):
+	""" Open the journal of processed apps for appending.
 		
 		Arguments:
 		args -- the command line arguments object
-		apps -- dictionary of apps and their meta data
-		pos  -- the current position of the analyzer
+		
+		Returns:
+		The journal file object
 		"""
-	pickle.dump(apps, open(args.f_cache, 'wb'))
-	pickle.dump(pos, open(args.f_pos, 'wb'))
+	journal = open(args.f_journal, 'a+')
+	
+	# terminate a line left incomplete by a crash so the next entry is not lost
+	journal.seek(0, os.SEEK_END)
+	if journal.tell() > 0:
+		journal.seek(-1, os.SEEK_END)
+		last = journal.read(1)
+		journal.seek(0, os.SEEK_END)
+		if last != "\n":
+			journal.write("\n")
+	return journal
 
-def clearRestorePoint(args, apps):
-	""" Remove the restoration point.
+def appendJournal(journal, app, version, result):
+	""" Add a processed app to the journal.
+		
+		The entry is not guaranteed to be on disk until the next restore point.
 		
 		Arguments:
-		args -- the command line arguments object
-		apps -- dictionary of apps and their meta data
+		journal -- the journal file object
+		app     -- the ID of the app
+		version -- the version of the app which was processed
+		result  -- the result of the analysis, or None
+		"""
+	journal.write(json.dumps({'app':app, 'version':version, 'result':result}) + "\n")
+
+def createRestorePoint(args, apps, journal):
+	""" Create a point for resuming analyzing.
+		
+		Only the journal is synced to disk, a pickle cache is not rewritten
+		since the results can be restored from the journal.
+		
+		Arguments:
+		args    -- the command line arguments object
+		apps    -- dictionary of apps and their meta data
+		journal -- the journal file object
 		"""
+	journal.flush()
+	os.fsync(journal.fileno())
+	commitResultCache(args)
+	if args.db:
+		commitCache(args, apps)
+
+def clearRestorePoint(args, apps, journal):
+	""" Save the cache and remove the restoration point.
+		
+		Arguments:
+		args    -- the command line arguments object
+		apps    -- dictionary of apps and their meta data
+		journal -- the journal file object
+		"""
+	journal.close()
+	commitResultCache(args)
+	commitCache(args, apps)
 	try:
-		os.remove(args.f_pos)
+		os.remove(args.f_journal)
 	except:
-		None
-	pickle.dump(apps, open(args.f_cache, "wb"))
\ No newline at end of file
+		None
\ No newline at end of file
@@ -2,6 +2,10 @@
 
 import math
 
+# labels of the ranges returned by ratingRange() and downloadRange()
+RATING_RANGES = ['0-1', '1-2', '2-3', '3-4', '4-5', 'Unknown']
+DOWNLOAD_RANGES = ['0-99', '100-9,999', '10,000-999,999', '1,000,000-99,999,999', '100,000,000+']
+
 def roundUp(number):
 	""" Round up an integer to the nearest power of then of the same degree.
 		Exempel: 35 -> 40, 540 -> 600, 1250 -> 2000, etc """
@@ -38,6 +42,12 @@ def downloadRange(app):
 		downloads = '100,000,000+'
 	return downloads
 
+class Percentage(float):
+	""" A percentage which is printed with two decimals and a percent sign. """
+	
+	def __str__(self):
+		return "%.2f%%" % self
+
 def percentage(fraction, total):
 	""" Calculate the percentage without risk of division by zero
 		
@@ -46,7 +56,7 @@ def percentage(fraction, total):
 		total    -- the total size of samples
 		
 		Returns:
-		fraction as a percentage of total
+		fraction as a Percentage of total, rounded like it is printed
 		"""
 	p = 0 if total == 0 else 100.0 * fraction / total
-	return "%.2f%%" % p
\ No newline at end of file
+	return Percentage("%.2f" % p)
\ No newline at end of file
@@ -24,11 +24,4 @@ def title_except(s, exceptions):
 	final = [word_list[0].capitalize()]
 	for word in word_list[1:]:
 		final.append(word in exceptions and word or word.capitalize())
-	return " ".join(final)
-
-def str2float(str):
-	""" convert a string to a float """
-	try:
-		return float(re.sub("[^0-9\.]", "", str))
-	except:
-		return 0
\ No newline at end of file
+	return " ".join(final)
\ No newline at end of file
@@ -0,0 +1,45 @@
+""" This file contains code for tables of statistics. """
+
+from operator import itemgetter
+
+class Table(object):
+	""" A table of data with a header, rows and an optional total row.
+		
+		Cells keep their numbers, such as counts and Percentages, so rows
+		can be sorted and graphed directly. They are only turned into text
+		when the table is printed.
+		"""
+	
+	def __init__(self, header, total = None):
+		"""
+			Arguments:
+			header -- tuple with the names of the columns
+			total  -- tuple with the total row, or None
+			"""
+		self.header = header
+		self.rows = []
+		self.total = total
+	
+	def add(self, *row):
+		""" Add a row to the table. """
+		self.rows.append(row)
+	
+	def sort(self, column, reverse = False):
+		""" Sort the rows by the value of a column. """
+		self.rows.sort(key=itemgetter(column), reverse=reverse)
+	
+	def graph(self, value, percent):
+		""" Get the rows as data for a bar graph.
+			
+			Arguments:
+			value   -- the column with the length of the bars
+			percent -- the column with the percentage of the line
+			
+			Returns:
+			A list of 3-tuples (name, value, percentage), see printTexGraph.
+			"""
+		return [(row[0], row[value], int(row[percent])) for row in self.rows]
+	
+	def lines(self):
+		""" Get all rows of the table, starting with the header and ending with the total. """
+		return [self.header] + self.rows + ([self.total] if self.total else [])
@@ -0,0 +1,153 @@
+""" This file contains code for analyzing apps in isolated worker processes.
+
+Some apks make the analysis run for hours or use tens of gigabytes. Each
+analysis is therefore run in a child process with a limit on its time and
+memory, so a single app cannot stall or kill the whole run. The child is
+replaced after a number of apps, since the analysis leaks memory.
+"""
+
+import multiprocessing
+import resource
+import signal
+import sys
+
+from analyze import *
+
+# exit code of a child process which ran out of memory outside of an analysis
+EXIT_OOM = 3
+
+def addressSpace():
+	""" Get the size of the address space of this process in bytes, or 0 if it is unknown. """
+	try:
+		return int(open('/proc/self/statm').read().split()[0]) * resource.getpagesize()
+	except:
+		return 0
+
+def serve(conn, memory, prefilter = True, mode = 'full'):
+	""" Analyze apks sent over a connection until None is sent.
+
+		Arguments:
+		conn      -- the connection to the parent process
+		memory    -- how many bytes the process may use on top of what it uses now, 0 for no limit
+		prefilter -- whether to skip the analysis of apps without SSL code, see dex.py
+		mode      -- 'full', 'fast' or 'fake', see analyzeApk()
+		"""
+	if memory > 0:
+		limit = addressSpace() + memory
+		resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+	try:
+		while True:
+			filename = conn.recv()
+			if filename is None:
+				break
+			try:
+				result, timings = analyzeApkTimed(filename, prefilter, mode)
+				status = 'analyzed' if result else 'analysis failed'
+			except MemoryError:
+				result, timings, status = None, {}, 'oom'
+			conn.send((status, result, timings))
+
+			# the process may be in a bad state after running out of memory
+			if status == 'oom':
+				break
+	except MemoryError:
+		# e.g. while sending a large result, the parent tells it from a crash by the exit code
+		sys.exit(EXIT_OOM)
+
+class AnalysisWorker(object):
+	""" A child process which analyzes one apk at a time within limits. """
+
+	def __init__(self, timeout = 0, memory = 0, recycle = 0, prefilter = True, mode = 'full'):
+		"""
+			Arguments:
+			timeout   -- how many seconds an analysis may take, 0 for no limit
+			memory    -- how many bytes an analysis may use, 0 for no limit
+			recycle   -- how many apps to analyze before replacing the process, 0 to never replace it
+			prefilter -- whether to skip the analysis of apps without SSL code, see dex.py
+			mode      -- 'full', 'fast' or 'fake', see analyzeApk()
+			"""
+		self.timeout = timeout
+		self.memory = memory
+		self.recycle = recycle
+		self.prefilter = prefilter
+		self.mode = mode
+		self.process = None
+		self.conn = None
+		self.analyzed = 0
+
+	def start(self):
+		""" Start a new child process. """
+		self.conn, child = multiprocessing.Pipe()
+		self.process = multiprocessing.Process(target=serve, args=(child, self.memory, self.prefilter, self.mode))
+		self.process.daemon = True
+		self.process.start()
+		child.close()
+		self.analyzed = 0
+
+	def stop(self):
+		""" Stop the child process, killing it if it does not stop by itself. """
+		if self.process is None:
+			return
+		try:
+			self.conn.send(None)
+		except:
+			None
+		self.process.join(5)
+		if self.process.is_alive():
+			self.process.terminate()
+			self.process.join()
+		self.conn.close()
+		self.process = None
+
+	def died(self):
+		""" Tell why the child process died, 'oom' if it ran out of memory and 'crashed' otherwise.
+
+			The kernel kills processes which use too much memory with SIGKILL,
+			and the child exits with EXIT_OOM if it runs out of memory outside
+			of an analysis.
+			"""
+		self.process.join(5)
+		code = self.process.exitcode
+		self.kill()
+		return 'oom' if code in [-signal.SIGKILL, EXIT_OOM] else 'crashed'
+
+	def kill(self):
+		""" Kill the child process. """
+		self.process.terminate()
+		self.process.join()
+		self.conn.close()
+		self.process = None
+
+	def analyze(self, filename):
+		""" Analyze an apk in the child process.
+
+			Arguments:
+			filename -- the filename of the app's apk
+
+			Returns:
+			A tuple (status, result, timings) where status is 'analyzed',
+			'analysis failed', 'timeout', 'oom' or 'crashed', result is the
+			result of analyzeApk() and timings are the measurements of
+			analyzeApkTimed().
+			"""
+		if self.process is not None and (not self.process.is_alive() or (self.recycle > 0 and self.analyzed >= self.recycle)):
+			self.stop()
+		if self.process is None:
+			self.start()
+		self.analyzed += 1
+
+		self.conn.send(filename)
+		if not self.conn.poll(self.timeout if self.timeout > 0 else None):
+			self.kill()
+			return ('timeout', None, {})
+		try:
+			status, result, timings = self.conn.recv()
+		except EOFError:
+			# the process died without sending a result
+			return (self.died(), None, {})
+
+		# the process stops by itself after running out of memory
+		if status == 'oom':
+			self.stop()
+		return (status, result, timings)